@@ -0,0 +1,276 @@
+// Frame energy kernels of silence, with SSE2/AVX2 versions chosen at runtime.
+// Shared by silence.cpp & energytest.cpp, which checks them against the scalar ones.
+// Public domain.
+
+#ifndef SILENCE_ENERGY_H
+#define SILENCE_ENERGY_H
+
+#include <cmath>
+#include <cstddef>
+
+#if (defined(__x86_64__) || defined(__i386__)) && defined(__GNUC__)
+#define SILENCE_X86
+#include <immintrin.h>
+#endif
+
+namespace Energy
+// Sums of sample magnitudes/squares over a buffer, the detector's hot loop.
+// Floating point sums use 8 interleaved lanes reduced in a fixed order so that
+// the SIMD versions give results identical to the scalar ones.
+{
+  const unsigned kLanes = 8;
+
+  inline unsigned magnitude(int s)
+  // |s| without overflow for INT_MIN
+  {
+    const unsigned sign = s >> 31;
+    return (static_cast<unsigned>(s) ^ sign) - sign;
+  }
+
+  inline double reduce(const double* lane)
+  // Combine 8 lanes: pairs 4 apart, then 2 apart, then adjacent
+  {
+    const double a0 = lane[0] + lane[4], a1 = lane[1] + lane[5],
+                 a2 = lane[2] + lane[6], a3 = lane[3] + lane[7];
+    return (a0 + a2) + (a1 + a3);
+  }
+
+  unsigned long long absInt32Scalar(const int* s, size_t n)
+  {
+    unsigned long long sum = 0;
+    for (size_t i = 0; i < n; i++)
+      sum += magnitude(s[i]);
+    return sum;
+  }
+
+  double sqInt32Scalar(const int* s, size_t n)
+  {
+    double lane[kLanes] = {0};
+    size_t i = 0;
+    for (; i + kLanes <= n; i += kLanes)
+      for (unsigned k = 0; k < kLanes; k++)
+        lane[k] += static_cast<double>(s[i + k]) * static_cast<double>(s[i + k]);
+    double sum = reduce(lane);
+    for (; i < n; i++)
+      sum += static_cast<double>(s[i]) * static_cast<double>(s[i]);
+    return sum;
+  }
+
+  double absFloatScalar(const float* s, size_t n)
+  {
+    double lane[kLanes] = {0};
+    size_t i = 0;
+    for (; i + kLanes <= n; i += kLanes)
+      for (unsigned k = 0; k < kLanes; k++)
+        lane[k] += fabs(static_cast<double>(s[i + k]));
+    double sum = reduce(lane);
+    for (; i < n; i++)
+      sum += fabs(static_cast<double>(s[i]));
+    return sum;
+  }
+
+  double sqFloatScalar(const float* s, size_t n)
+  {
+    double lane[kLanes] = {0};
+    size_t i = 0;
+    for (; i + kLanes <= n; i += kLanes)
+      for (unsigned k = 0; k < kLanes; k++)
+        lane[k] += static_cast<double>(s[i + k]) * static_cast<double>(s[i + k]);
+    double sum = reduce(lane);
+    for (; i < n; i++)
+      sum += static_cast<double>(s[i]) * static_cast<double>(s[i]);
+    return sum;
+  }
+
+#ifdef SILENCE_X86
+  __attribute__((target("sse2")))
+  unsigned long long absInt32SSE2(const int* s, size_t n)
+  {
+    const __m128i zero = _mm_setzero_si128();
+    __m128i acc = zero;
+    size_t i = 0;
+    for (; i + 4 <= n; i += 4)
+      {
+        const __m128i x = _mm_loadu_si128(reinterpret_cast<const __m128i*>(s + i));
+        const __m128i sign = _mm_srai_epi32(x, 31);
+        const __m128i m = _mm_sub_epi32(_mm_xor_si128(x, sign), sign);
+        acc = _mm_add_epi64(acc, _mm_add_epi64(_mm_unpacklo_epi32(m, zero),
+                                               _mm_unpackhi_epi32(m, zero)));
+      }
+    unsigned long long part[2];
+    _mm_storeu_si128(reinterpret_cast<__m128i*>(part), acc);
+    return part[0] + part[1] + absInt32Scalar(s + i, n - i);
+  }
+
+  __attribute__((target("sse2")))
+  inline double reduceSSE2(__m128d r0, __m128d r1, __m128d r2, __m128d r3)
+  // reduce() for lanes held as {0,1} {2,3} {4,5} {6,7}
+  {
+    const __m128d b = _mm_add_pd(_mm_add_pd(r0, r2), _mm_add_pd(r1, r3));
+    return _mm_cvtsd_f64(_mm_add_sd(b, _mm_unpackhi_pd(b, b)));
+  }
+
+  __attribute__((target("sse2")))
+  double sqInt32SSE2(const int* s, size_t n)
+  {
+    __m128d r[4] = {_mm_setzero_pd(), _mm_setzero_pd(), _mm_setzero_pd(), _mm_setzero_pd()};
+    size_t i = 0;
+    for (; i + kLanes <= n; i += kLanes)
+      for (unsigned k = 0; k < 4; k++)
+        {
+          const __m128d x = _mm_cvtepi32_pd(_mm_loadl_epi64(reinterpret_cast<const __m128i*>(s + i + 2 * k)));
+          r[k] = _mm_add_pd(r[k], _mm_mul_pd(x, x));
+        }
+    double sum = reduceSSE2(r[0], r[1], r[2], r[3]);
+    for (; i < n; i++)
+      sum += static_cast<double>(s[i]) * static_cast<double>(s[i]);
+    return sum;
+  }
+
+  __attribute__((target("sse2")))
+  double absFloatSSE2(const float* s, size_t n)
+  {
+    const __m128d mask = _mm_castsi128_pd(_mm_set1_epi64x(0x7fffffffffffffffLL));
+    __m128d r[4] = {_mm_setzero_pd(), _mm_setzero_pd(), _mm_setzero_pd(), _mm_setzero_pd()};
+    size_t i = 0;
+    for (; i + kLanes <= n; i += kLanes)
+      for (unsigned k = 0; k < 4; k++)
+        {
+          const __m128d x = _mm_cvtps_pd(_mm_castsi128_ps(_mm_loadl_epi64(reinterpret_cast<const __m128i*>(s + i + 2 * k))));
+          r[k] = _mm_add_pd(r[k], _mm_and_pd(x, mask));
+        }
+    double sum = reduceSSE2(r[0], r[1], r[2], r[3]);
+    for (; i < n; i++)
+      sum += fabs(static_cast<double>(s[i]));
+    return sum;
+  }
+
+  __attribute__((target("sse2")))
+  double sqFloatSSE2(const float* s, size_t n)
+  {
+    __m128d r[4] = {_mm_setzero_pd(), _mm_setzero_pd(), _mm_setzero_pd(), _mm_setzero_pd()};
+    size_t i = 0;
+    for (; i + kLanes <= n; i += kLanes)
+      for (unsigned k = 0; k < 4; k++)
+        {
+          const __m128d x = _mm_cvtps_pd(_mm_castsi128_ps(_mm_loadl_epi64(reinterpret_cast<const __m128i*>(s + i + 2 * k))));
+          r[k] = _mm_add_pd(r[k], _mm_mul_pd(x, x));
+        }
+    double sum = reduceSSE2(r[0], r[1], r[2], r[3]);
+    for (; i < n; i++)
+      sum += static_cast<double>(s[i]) * static_cast<double>(s[i]);
+    return sum;
+  }
+
+  __attribute__((target("avx2")))
+  unsigned long long absInt32AVX2(const int* s, size_t n)
+  {
+    __m256i acc = _mm256_setzero_si256();
+    size_t i = 0;
+    for (; i + 8 <= n; i += 8)
+      {
+        const __m256i m = _mm256_abs_epi32(_mm256_loadu_si256(reinterpret_cast<const __m256i*>(s + i)));
+        acc = _mm256_add_epi64(acc, _mm256_add_epi64(_mm256_cvtepu32_epi64(_mm256_castsi256_si128(m)),
+                                                     _mm256_cvtepu32_epi64(_mm256_extracti128_si256(m, 1))));
+      }
+    unsigned long long part[4];
+    _mm256_storeu_si256(reinterpret_cast<__m256i*>(part), acc);
+    return part[0] + part[1] + part[2] + part[3] + absInt32Scalar(s + i, n - i);
+  }
+
+  __attribute__((target("avx2")))
+  inline double reduceAVX2(__m256d lo, __m256d hi)
+  // reduce() for lanes held as {0,1,2,3} {4,5,6,7}
+  {
+    const __m256d a = _mm256_add_pd(lo, hi);
+    const __m128d b = _mm_add_pd(_mm256_castpd256_pd128(a), _mm256_extractf128_pd(a, 1));
+    return _mm_cvtsd_f64(_mm_add_sd(b, _mm_unpackhi_pd(b, b)));
+  }
+
+  __attribute__((target("avx2")))
+  double sqInt32AVX2(const int* s, size_t n)
+  {
+    __m256d lo = _mm256_setzero_pd(), hi = _mm256_setzero_pd();
+    size_t i = 0;
+    for (; i + kLanes <= n; i += kLanes)
+      {
+        const __m256d x = _mm256_cvtepi32_pd(_mm_loadu_si128(reinterpret_cast<const __m128i*>(s + i)));
+        const __m256d y = _mm256_cvtepi32_pd(_mm_loadu_si128(reinterpret_cast<const __m128i*>(s + i + 4)));
+        lo = _mm256_add_pd(lo, _mm256_mul_pd(x, x));
+        hi = _mm256_add_pd(hi, _mm256_mul_pd(y, y));
+      }
+    double sum = reduceAVX2(lo, hi);
+    for (; i < n; i++)
+      sum += static_cast<double>(s[i]) * static_cast<double>(s[i]);
+    return sum;
+  }
+
+  __attribute__((target("avx2")))
+  double absFloatAVX2(const float* s, size_t n)
+  {
+    const __m256d mask = _mm256_castsi256_pd(_mm256_set1_epi64x(0x7fffffffffffffffLL));
+    __m256d lo = _mm256_setzero_pd(), hi = _mm256_setzero_pd();
+    size_t i = 0;
+    for (; i + kLanes <= n; i += kLanes)
+      {
+        lo = _mm256_add_pd(lo, _mm256_and_pd(_mm256_cvtps_pd(_mm_loadu_ps(s + i)), mask));
+        hi = _mm256_add_pd(hi, _mm256_and_pd(_mm256_cvtps_pd(_mm_loadu_ps(s + i + 4)), mask));
+      }
+    double sum = reduceAVX2(lo, hi);
+    for (; i < n; i++)
+      sum += fabs(static_cast<double>(s[i]));
+    return sum;
+  }
+
+  __attribute__((target("avx2")))
+  double sqFloatAVX2(const float* s, size_t n)
+  {
+    __m256d lo = _mm256_setzero_pd(), hi = _mm256_setzero_pd();
+    size_t i = 0;
+    for (; i + kLanes <= n; i += kLanes)
+      {
+        const __m256d x = _mm256_cvtps_pd(_mm_loadu_ps(s + i));
+        const __m256d y = _mm256_cvtps_pd(_mm_loadu_ps(s + i + 4));
+        lo = _mm256_add_pd(lo, _mm256_mul_pd(x, x));
+        hi = _mm256_add_pd(hi, _mm256_mul_pd(y, y));
+      }
+    double sum = reduceAVX2(lo, hi);
+    for (; i < n; i++)
+      sum += static_cast<double>(s[i]) * static_cast<double>(s[i]);
+    return sum;
+  }
+#endif
+
+  // Kernels chosen for this CPU by select()
+  unsigned long long (*absInt32)(const int*, size_t) = absInt32Scalar;
+  double (*sqInt32)(const int*, size_t) = sqInt32Scalar;
+  double (*absFloat)(const float*, size_t) = absFloatScalar;
+  double (*sqFloat)(const float*, size_t) = sqFloatScalar;
+
+  const char* select()
+  // Pick the fastest kernels the CPU supports. Returns their name
+  {
+#ifdef SILENCE_X86
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("avx2"))
+      {
+        absInt32 = absInt32AVX2;
+        sqInt32 = sqInt32AVX2;
+        absFloat = absFloatAVX2;
+        sqFloat = sqFloatAVX2;
+        return "AVX2";
+      }
+    if (__builtin_cpu_supports("sse2"))
+      {
+        absInt32 = absInt32SSE2;
+        sqInt32 = sqInt32SSE2;
+        absFloat = absFloatSSE2;
+        sqFloat = sqFloatSSE2;
+        return "SSE2";
+      }
+#endif
+    return "scalar";
+  }
+}
+
+#endif
@@ -0,0 +1,150 @@
+// Checks that the SIMD energy kernels of silence give results bit for bit identical
+// to the scalar ones, for every length up to a few blocks, unaligned buffers & extreme samples.
+// v1.0 Initial version
+// Public domain. Run by "make check"
+
+#include <cstdio>
+#include <cstring>
+#include <climits>
+#include <cfloat>
+#include <vector>
+#include "energy.h"
+
+namespace
+{
+  unsigned failures = 0;
+  unsigned checks = 0;
+  unsigned long long seed = 1;
+
+  unsigned next()
+  // Deterministic pseudo-random 32 bits, so a failure can be reproduced
+  {
+    seed = seed * 6364136223846793005ULL + 1442695040888963407ULL;
+    return static_cast<unsigned>(seed >> 32);
+  }
+
+  bool same(double a, double b)
+  {
+    return memcmp(&a, &b, sizeof(a)) == 0;
+  }
+
+  void report(const char* kernel, const char* kind, size_t n, size_t offset, double want, double got)
+  {
+    if (failures++ < 20)
+      printf("FAIL %s%s n=%zu offset=%zu: scalar %.17g, got %.17g\n", kernel, kind, n, offset, want, got);
+  }
+
+  struct Kernels
+  {
+    const char* name;
+    unsigned long long (*absInt32)(const int*, size_t);
+    double (*sqInt32)(const int*, size_t);
+    double (*absFloat)(const float*, size_t);
+    double (*sqFloat)(const float*, size_t);
+  };
+
+  void compare(const Kernels& k, const int* s, const float* f, size_t n, size_t offset)
+  // Checks one buffer against the scalar kernels
+  {
+    checks++;
+    const unsigned long long a = Energy::absInt32Scalar(s, n), b = k.absInt32(s, n);
+    if (a != b)
+      report(k.name, " absInt32", n, offset, a, b);
+    if (!same(Energy::sqInt32Scalar(s, n), k.sqInt32(s, n)))
+      report(k.name, " sqInt32", n, offset, Energy::sqInt32Scalar(s, n), k.sqInt32(s, n));
+    if (!same(Energy::absFloatScalar(f, n), k.absFloat(f, n)))
+      report(k.name, " absFloat", n, offset, Energy::absFloatScalar(f, n), k.absFloat(f, n));
+    if (!same(Energy::sqFloatScalar(f, n), k.sqFloat(f, n)))
+      report(k.name, " sqFloat", n, offset, Energy::sqFloatScalar(f, n), k.sqFloat(f, n));
+  }
+
+  void fill(std::vector<int>& s, std::vector<float>& f, unsigned pattern)
+  // Random samples, with extremes sprinkled in or filling the buffer
+  {
+    for (size_t i = 0; i < s.size(); i++)
+      {
+        const unsigned r = next();
+        switch (pattern)
+          {
+          case 0: // full scale
+            s[i] = static_cast<int>(r);
+            f[i] = static_cast<int>(r) / 2147483648.0f;
+            break;
+          case 1: // quiet, with the extremes now & then
+            s[i] = static_cast<int>(r % 2001) - 1000;
+            f[i] = s[i] * 1e-6f;
+            if (r % 13 == 0)
+              {
+                s[i] = INT_MIN;
+                f[i] = -FLT_MAX;
+              }
+            else if (r % 17 == 0)
+              {
+                s[i] = INT_MAX;
+                f[i] = FLT_MIN / 4; // denormal
+              }
+            break;
+          default: // nothing but the most negative sample
+            s[i] = INT_MIN;
+            f[i] = -1.0f;
+          }
+      }
+  }
+
+  void run(const Kernels& k)
+  // Every length up to 80, some long odd ones, each at aligned & unaligned starts
+  {
+    static const size_t kLong[] = {255, 1001, 4097, 48001, 1920 * 6 + 3};
+    std::vector<size_t> lengths;
+    for (size_t n = 0; n <= 80; n++)
+      lengths.push_back(n);
+    lengths.insert(lengths.end(), kLong, kLong + sizeof(kLong) / sizeof(kLong[0]));
+    for (unsigned pattern = 0; pattern < 3; pattern++)
+      for (size_t j = 0; j < lengths.size(); j++)
+        {
+          const size_t n = lengths[j];
+          std::vector<int> s(n + 8);
+          std::vector<float> f(n + 8);
+          fill(s, f, pattern);
+          for (size_t offset = 0; offset < 8; offset++)
+            compare(k, &s[offset], &f[offset], n, offset);
+        }
+    printf("%-6s checked %u buffers\n", k.name, checks);
+    checks = 0;
+  }
+}
+
+int main()
+{
+  unsigned tested = 0;
+#ifdef SILENCE_X86
+  __builtin_cpu_init();
+  if (__builtin_cpu_supports("sse2"))
+    {
+      const Kernels sse2 = {"SSE2", Energy::absInt32SSE2, Energy::sqInt32SSE2,
+                            Energy::absFloatSSE2, Energy::sqFloatSSE2};
+      run(sse2);
+      tested++;
+    }
+  if (__builtin_cpu_supports("avx2"))
+    {
+      const Kernels avx2 = {"AVX2", Energy::absInt32AVX2, Energy::sqInt32AVX2,
+                            Energy::absFloatAVX2, Energy::sqFloatAVX2};
+      run(avx2);
+      tested++;
+    }
+#endif
+  if (!tested)
+    printf("No SIMD kernels for this CPU, nothing to check\n");
+  // the dispatched kernels must be one of those checked
+  const char* chosen = Energy::select();
+  const Kernels selected = {chosen, Energy::absInt32, Energy::sqInt32, Energy::absFloat, Energy::sqFloat};
+  run(selected);
+  if (failures)
+    {
+      printf("%u kernel results differ from the scalar ones\n", failures);
+      return 1;
+    }
+  printf("Energy kernels match the scalar ones\n");
+  return 0;
+}
@@ -5,20 +5,46 @@
 // v4.0 Kill process argv[1] when idle for 30 seconds.
 // v4.1 Fix averaging overflow
 // v4.2 Unblock the alarm signal so the job actually finishes.
-// Public domain. Requires libsndfile
+// v4.3 Configurable idle timeout (-t), only armed when there is a process to kill.
+// v5.0 Optional native decoding of the recording with libavcodec (-n).
+// v5.1 Vectorised energy kernels (SSE2/AVX2) selected at runtime, optional RMS level (-r).
+// v5.2 Video frame rate is an option (-f), exact for fractional NTSC rates.
+// v5.3 Read AU input in blocks of several seconds rather than a frame at a time.
+// v5.4 Optional binary records of silences/clusters/cuts on a separate fd (-b).
+// v5.5 Only format log lines the wrapper wants (-v), block buffer all but cuts.
+// v5.6 Optionally save the level of every frame to a gzipped profile (-p).
+// v5.7 Keep silences & clusters by value with a bounded history, memory no longer grows.
+// v5.8 64-bit frame numbers. Stream mode (-s) for continuous input, with progress records.
+// v5.9 Progress lines carry the detector state, which -R resumes from part way into the audio (-a).
+// v6.0 Optional adaptive threshold (-A) that follows the programme's noise floor.
+// v6.1 Profiles record the channels levels are averaged over, & have room for the source's identity.
+// Public domain. Requires libsndfile & zlib, optionally libavformat/libavcodec
 // Detects commercial breaks using clusters of audio silences
 
 #include <cstdlib>
 #include <cmath>
 #include <cerrno>
 #include <climits>
+#include <stdint.h>
 #include <deque>
+#include <algorithm>
+#include <functional>
 #include <sndfile.h>
+#include <zlib.h>
 #include <unistd.h>
 #include <signal.h>
+#include "energy.h"
 
-typedef unsigned frameNumber_t;
-typedef unsigned frameCount_t;
+#ifdef HAVE_LIBAV
+#define __STDC_CONSTANT_MACROS
+extern "C" {
+#include <libavformat/avformat.h>
+#include <libavcodec/avcodec.h>
+}
+#endif
+
+typedef unsigned long long frameNumber_t;
+typedef unsigned long long frameCount_t;
 
 // Output to python wrapper requires prefix to indicate level
 #define DELIMITER "@" // must correlate with python wrapper
@@ -26,6 +52,20 @@ char prefixdebug[7] = "debug" DELIMITER;
 char prefixinfo[6]  = "info" DELIMITER;
 char prefixerr[5]   = "err" DELIMITER;
 char prefixcut[5]   = "cut" DELIMITER;
+char prefixprogress[10] = "progress" DELIMITER;
+
+// Lines above this level are not formatted: 0 = errors, cuts & progress, 1 = info, 2 = debug
+unsigned logLevel = 2;
+
+bool logging(const char* prefix)
+// Whether lines with this prefix are wanted
+{
+  if (prefix == prefixdebug)
+    return logLevel >= 2;
+  if (prefix == prefixinfo)
+    return logLevel >= 1;
+  return true;
+}
 
 void error(const char* mesg, bool die = true)
 {
@@ -35,6 +75,7 @@ void error(const char* mesg, bool die = true)
 }
 
 pid_t tail_pid = 0;
+unsigned idleTimeout = 30; // seconds without input before tail_pid is killed
 void watchdog(int sig)
 {
   if (0 != tail_pid)
@@ -44,8 +85,11 @@ void watchdog(int sig)
 namespace Arg
 // Program argument management
 {
-  const float kvideoRate = 25.0;  // sample rate in fps (maps time to frame count)
-  const frameCount_t krateInMins = kvideoRate * 60; // frames per min
+  unsigned rateNum = 25;          // video frame rate as a fraction (maps time to frame count)
+  unsigned rateDen = 1;
+  float videoRate;                // frame rate in fps
+  frameCount_t rateInMins;        // frames per min
+  frameCount_t rateRound;         // frames in half a second, for rounding to seconds
   unsigned useThreshold;          // Audio level of silence
   frameCount_t useMinQuiet;       // Minimum length of a silence to register
   unsigned useMinDetect;          // Minimum number of silences that constitute an advert
@@ -53,11 +97,32 @@ namespace Arg
   frameCount_t useMaxSep;         // silences must be closer than this to be in the same cluster
   frameCount_t usePad;            // padding for each cut
   bool onlyCutPreroll;            // If set, only commflag the pre-roll
+  bool nativeDecode = false;      // Decode the recording with libav instead of reading AU
+  unsigned refChannels = 0;       // Channel count levels are normalised to (0 = as input)
+  bool useRms = false;            // Use RMS level rather than mean magnitude
+  int recordFd = -1;              // fd for binary records (-1 = none)
+  const char* profilePath = NULL; // file for the level profile (NULL = none)
+  frameCount_t streamFrames = 0;  // stream mode: frames between progress reports (0 = not streaming)
+  const char* resumeState = NULL; // state from a progress line to resume from (NULL = start afresh)
+  unsigned long long startSample = 0; // sample of the audio that the input starts at, when resuming
+  float adaptMargin = 0;          // adaptive threshold: dB above the noise floor (0 = fixed threshold)
 
   void usage()
   {
-    error("Usage: silence <tail_pid> <threshold> <minquiet> <mindetect> <minlength> <maxsep> <pad> <preroll>", false);
-    error("<tail_pid> : (int)    Process ID to be killed after idle timeout.", false);
+    error("Usage: silence [-t <timeout>] [-n] [-c <channels>] [-r] [-f <fps>] [-b <fd>] [-p <file>] [-s <frames>] [-R <state> [-a <sample>]] [-A <margin>] [-v <level>] <tail_pid> <threshold> <minquiet> <mindetect> <minlength> <maxsep> <pad> <preroll>", false);
+    error("-t <timeout>: (int)   Idle seconds before tail_pid is killed (default 30, 0 = never).", false);
+    error("-n          :         Input is a recording to be decoded with libav rather than AU audio.", false);
+    error("-c <channels>: (int)  Normalise levels to this many channels, ie. the upmix of the AU path.", false);
+    error("-r          :         Measure RMS level of each frame rather than mean magnitude.", false);
+    error("-f <fps>    :         Video frame rate as a number or fraction, eg. 25 or 30000/1001 (default 25).", false);
+    error("-b <fd>     :         Also write binary silence/cluster/cut records to this file descriptor.", false);
+    error("-p <file>   :         Also save the level of every frame to this gzipped profile.", false);
+    error("-s <frames> : (int)   Stream: report progress every <frames> frames & keep no cluster history.", false);
+    error("-R <state>  :         Resume detection from the state following the frame count of a progress line.", false);
+    error("-a <sample> : (int)   The input starts at this sample of the audio, at or before the resume frame.", false);
+    error("-A <margin> : (float) Adapt the threshold to <margin> dB above the noise floor, after a minute at <threshold>.", false);
+    error("-v <level>  : (int)   Log level: 0 errors & cuts, 1 info, 2 debug (default 2).", false);
+    error("<tail_pid> : (int)    Process ID to be killed after idle timeout (0 for none).", false);
     error("<threshold>: (float)  silence threshold in dB.", false);
     error("<minquiet> : (float)  minimum time for silence detection in seconds.", false);
     error("<mindetect>: (float)  minimum number of silences to constitute an advert.", false);
@@ -69,9 +134,95 @@ namespace Arg
     error("Example: silence 4567 -75 0.1 5 60 90 1 0 < audio.au");
   }
 
+  void parseRate(const char* arg)
+  // Parse a frame rate given as a fraction or a decimal number
+  {
+    double rate;
+    if (2 == sscanf(arg, "%u/%u", &rateNum, &rateDen))
+      {
+        if (0 == rateNum || 0 == rateDen)
+          error("Frame rate must be positive");
+        return;
+      }
+    if (1 != sscanf(arg, "%lf", &rate) || rate <= 0)
+      error("Could not parse frame rate option into a number");
+    // decimal NTSC rates such as 29.97 or 59.94 mean n*1000/1001
+    const double whole = rint(rate * 1.001);
+    if (fabs(rate - whole / 1.001) < 0.005 && fabs(rate - whole) > 0.005)
+      {
+        rateNum = whole * 1000;
+        rateDen = 1001;
+      }
+    else
+      {
+        rateNum = rint(rate * 1000);
+        rateDen = 1000;
+      }
+  }
+
+  size_t frameStart(unsigned rate, unsigned long long frame)
+  // Audio sample (per channel) at which a frame starts, counting frames from 0
+  {
+    return frame * rate * rateDen / rateNum;
+  }
+
   void parse(int argc, char **argv)
   // Parse args and convert to useable values (frames)
   {
+    int opt;
+    while ((opt = getopt(argc, argv, "+t:nc:rf:b:p:s:R:a:A:v:")) != -1)
+      switch (opt)
+        {
+        case 't':
+          if (1 != sscanf(optarg, "%u", &idleTimeout))
+            error("Could not parse timeout option into a number");
+          break;
+        case 'n':
+          nativeDecode = true;
+          break;
+        case 'c':
+          if (1 != sscanf(optarg, "%u", &refChannels))
+            error("Could not parse channels option into a number");
+          break;
+        case 'r':
+          useRms = true;
+          break;
+        case 'f':
+          parseRate(optarg);
+          break;
+        case 'b':
+          if (1 != sscanf(optarg, "%d", &recordFd))
+            error("Could not parse record fd option into a number");
+          break;
+        case 'p':
+          profilePath = optarg;
+          break;
+        case 's':
+          if (1 != sscanf(optarg, "%llu", &streamFrames) || 0 == streamFrames)
+            error("Could not parse stream option into a positive number");
+          break;
+        case 'R':
+          resumeState = optarg;
+          break;
+        case 'a':
+          if (1 != sscanf(optarg, "%llu", &startSample))
+            error("Could not parse start sample option into a number");
+          break;
+        case 'A':
+          if (1 != sscanf(optarg, "%f", &adaptMargin) || adaptMargin <= 0)
+            error("Could not parse adaptive margin option into a positive number");
+          break;
+        case 'v':
+          if (1 != sscanf(optarg, "%u", &logLevel))
+            error("Could not parse log level option into a number");
+          break;
+        default:
+          usage();
+        }
+    // positional args follow the options
+    argc -= optind - 1;
+    argv += optind - 1;
+
     if (9 != argc)
       usage();
 
@@ -102,33 +253,46 @@ namespace Arg
       error("Could not parse preroll option into a number");
 
 
+    videoRate  = static_cast<double>(rateNum) / rateDen;
+    rateInMins = rint(videoRate * 60);
+    rateRound  = ceil(videoRate / 2);
+
     /* Scale threshold to integer range that libsndfile will use. */
     useThreshold = rint(INT_MAX * pow(10, argThreshold / 20));
 
     /* Scale times to frames. */
-    useMinQuiet  = ceil(argMinQuiet * kvideoRate);
+    useMinQuiet  = ceil(argMinQuiet * videoRate);
     useMinDetect = (int)argMinDetect;
-    useMinLength = ceil(argMinLength * kvideoRate);
-    useMaxSep    = rint(argMaxSep * kvideoRate + 0.5);
-    usePad       = rint(argPad * kvideoRate + 0.5);
+    useMinLength = ceil(argMinLength * videoRate);
+    useMaxSep    = rint(argMaxSep * videoRate + 0.5);
+    usePad       = rint(argPad * videoRate + 0.5);
     onlyCutPreroll = argPreroll != 0;
 
-    printf("%sThreshold=%.1f, MinQuiet=%.2f, MinDetect=%.1f, MinLength=%.1f, MaxSep=%.1f, Pad=%.2f\n",
-           prefixdebug, argThreshold, argMinQuiet, argMinDetect, argMinLength, argMaxSep, argPad);
-    printf("%sFrame rate is %.2f, Detecting silences below %d that last for at least %d frames\n",
-           prefixdebug, kvideoRate, useThreshold, useMinQuiet);
-    printf("%sClusters are composed of a minimum of %d silences closer than %d frames and must be\n",
-           prefixdebug, useMinDetect, useMaxSep);
-    printf("%slonger than %d frames in total. Cuts will be padded by %d frames.\n",
-           prefixdebug, useMinLength, usePad);
-    if (onlyCutPreroll) {
-      printf("%sOnly preroll will be cut.\n", prefixdebug);
-    } else {
-      printf("%sAll detected adverts will be cut.\n", prefixdebug);
-    }
-    printf("%s< preroll, > postroll, - advert, ? too few silences, # too short, = comm flagged\n", prefixdebug);
-    printf("%s           Start - End    Start - End      Duration         Interval    Level/Count\n", prefixinfo);
-    printf("%s          frame - frame (mmm:ss-mmm:ss) frame (mm:ss.s)  frame (mmm:ss)\n", prefixinfo);
+    if (logging(prefixdebug))
+      {
+        printf("%sThreshold=%.1f, MinQuiet=%.2f, MinDetect=%.1f, MinLength=%.1f, MaxSep=%.1f, Pad=%.2f\n",
+               prefixdebug, argThreshold, argMinQuiet, argMinDetect, argMinLength, argMaxSep, argPad);
+        printf("%sFrame rate is %.2f (%u/%u), Detecting silences below %d that last for at least %llu frames\n",
+               prefixdebug, videoRate, rateNum, rateDen, useThreshold, useMinQuiet);
+        printf("%sClusters are composed of a minimum of %d silences closer than %llu frames and must be\n",
+               prefixdebug, useMinDetect, useMaxSep);
+        printf("%slonger than %llu frames in total. Cuts will be padded by %llu frames.\n",
+               prefixdebug, useMinLength, usePad);
+        if (onlyCutPreroll) {
+          printf("%sOnly preroll will be cut.\n", prefixdebug);
+        } else {
+          printf("%sAll detected adverts will be cut.\n", prefixdebug);
+        }
+        if (adaptMargin > 0)
+          printf("%sThreshold adapts to %.1fdB above the noise floor after %llu frames.\n",
+                 prefixdebug, adaptMargin, rateInMins);
+        printf("%s< preroll, > postroll, - advert, ? too few silences, # too short, = comm flagged\n", prefixdebug);
+      }
+    if (logging(prefixinfo))
+      {
+        printf("%s           Start - End    Start - End      Duration         Interval    Level/Count\n", prefixinfo);
+        printf("%s          frame - frame (mmm:ss-mmm:ss) frame (mm:ss.s)  frame (mmm:ss)\n", prefixinfo);
+      }
   }
 }
 
@@ -139,16 +303,25 @@ public:
   enum state_t {progStart, detection, progEnd};
   static const char state_log[3];
 
-  const state_t state;       // type of silence
-  const frameNumber_t start; // frame of start
+  state_t state;             // type of silence
+  frameNumber_t start;       // frame of start
   frameNumber_t end;         // frame of end
   frameCount_t length;       // number of frames
   frameCount_t interval;     // frames between end of last silence & start of this one
   double power;              // average power level
 
-  Silence(frameNumber_t _start, double _power = 0, state_t _state = detection)
+  Silence(frameNumber_t _start = 0, double _power = 0, state_t _state = detection)
     : state(_state), start(_start), end(_start), length(1), interval(0), power(_power) {}
 
+  static Silence span(frameNumber_t _start, frameNumber_t _end, double _power)
+  // A silence from start to end with a given average power
+  {
+    Silence s(_start, _power);
+    s.end = _end;
+    s.length = _end - _start + 1;
+    return s;
+  }
+
   void extend(frameNumber_t frame, double _power)
   // Define end of the silence
   {
@@ -167,9 +340,9 @@ class Cluster
 private:
   void setState()
   {
-    if (this->start->start == 1)
+    if (this->start.start == 1)
       state = preroll;
-    else if (this->end->state == Silence::progEnd)
+    else if (this->end.state == Silence::progEnd)
       state = postroll;
     else if (length < Arg::useMinLength)
       state = tooshort;
@@ -187,31 +360,46 @@ public:
   static frameNumber_t completesAt; // frame where the most recent cluster will complete
 
   state_t state;          // type of cluster
-  const Silence* start;   // first silence
-  Silence* end;           // last silence
+  Silence start;          // first silence
+  Silence end;            // last silence
   frameNumber_t padStart, padEnd; // padded cluster start/end frames
   unsigned silenceCount;  // number of silences
   frameCount_t length;    // number of frames
   frameCount_t interval;  // frames between end of last cluster and start of this one
 
-  Cluster(Silence* s) : state(unset), start(s), end(s), silenceCount(1), length(s->length), interval(0)
+  Cluster() : state(unset), padStart(0), padEnd(0), silenceCount(0), length(0), interval(0) {}
+
+  Cluster(const Silence& s) : state(unset), start(s), end(s), silenceCount(1), length(s.length), interval(0)
   {
-    completesAt = end->end + Arg::useMaxSep; // finish cluster <maxsep> beyond silence end
+    completesAt = end.end + Arg::useMaxSep; // finish cluster <maxsep> beyond silence end
     setState();
     // pad everything except pre-rolls
-    padStart = (state == preroll ? 1 : start->start + Arg::usePad);
+    padStart = (state == preroll ? 1 : start.start + Arg::usePad);
+    padEnd = end.end - Arg::usePad;
   }
 
-  void extend(Silence* _end)
+  void extend(const Silence& _end)
   // Define end of a cluster
   {
     end = _end;
     silenceCount++;
-    length = end->end - start->start + 1;
-    completesAt = end->end + Arg::useMaxSep; // finish cluster <maxsep> beyond silence end
+    length = end.end - start.start + 1;
+    completesAt = end.end + Arg::useMaxSep; // finish cluster <maxsep> beyond silence end
     setState();
     // pad everything except post-rolls
-    padEnd = end->end - (state == postroll ? 0 : Arg::usePad);
+    padEnd = end.end - (state == postroll ? 0 : Arg::usePad);
+  }
+
+  void resume(const Silence& _end, unsigned count)
+  // Restore a cluster of <count> silences, the last being _end
+  {
+    if (count > 1)
+      {
+        extend(_end);
+        silenceCount = count;
+        setState();
+        padEnd = end.end - (state == postroll ? 0 : Arg::usePad);
+      }
   }
 };
 // c++0x doesn't allow initialisation within class
@@ -219,46 +407,120 @@ const char Cluster::state_log[6] = {'#', '?', '.', '<', '-', '>'};
 frameNumber_t Cluster::completesAt = 0;
 
 class ClusterList
-// Manages a list of detected silences and a list of assigned clusters
+// Holds the silence & cluster being built and a bounded history of completed ones, by value.
+// Only the most recent of each is needed to detect, so memory is constant however long the input
 {
-protected:
-  // list of detected silences
-  std::deque<Silence*> silence;
+public:
+  static const size_t kHistory = 64; // completed clusters kept
 
-  // list of deduced clusters of the silences
-  std::deque<Cluster*> cluster;
+protected:
+  Silence active;         // the silence being detected
+  Cluster building;       // the cluster being built
+  Silence lastSilence;    // most recent recorded silence
+  bool anySilence;
+  Cluster history[kHistory]; // ring of completed clusters
+  unsigned long long clusters; // clusters completed
 
 public:
-  Silence* insertStartSilence()
-  // Inserts a fake silence at the front of the silence list
+  ClusterList() : anySilence(false), clusters(0) {}
+
+  Silence* newSilence(frameNumber_t start, double power = 0, Silence::state_t state = Silence::detection)
+  // Starts the silence to be detected, replacing any previous one
+  {
+    active = Silence(start, power, state);
+    return &active;
+  }
+
+  Cluster* newCluster(const Silence& first)
+  // Starts the cluster to be built, replacing any previous one
+  {
+    building = Cluster(first);
+    return &building;
+  }
+
+  Silence startSilence() const
+  // A fake single frame silence at prog start
   {
-    // create a single frame silence at frame 1 and insert it at front
-    Silence* ref = new Silence(1, 0, Silence::progStart);
-    silence.push_front(ref);
-    return ref;
+    return Silence(1, 0, Silence::progStart);
   }
 
   void addSilence(Silence* newSilence)
-  // Adds a silence detection to the end of the silence list
+  // Records a silence detection
   {
     // set interval between this & previous silence/prog start
         newSilence->interval = newSilence->start
-	  - (silence.empty() ? 1 : silence.back()->end - 1);
+	  - (anySilence ? lastSilence.end - 1 : 1);
         // store silence
-        silence.push_back(newSilence);
+        lastSilence = *newSilence;
+        anySilence = true;
+  }
+
+  size_t kept() const
+  // Completed clusters kept in the history. A stream keeps only the most recent
+  {
+    return Arg::streamFrames ? 1 : kHistory;
   }
 
   void addCluster(Cluster* newCluster)
-  // Adds a cluster to end of the cluster list
+  // Records a completed cluster, forgetting the oldest once the history is full
   {
     // set interval between new cluster & previous one/prog start
-        newCluster->interval = newCluster->start->start
-	  - (cluster.empty() ? 1 : cluster.back()->end->end - 1);
+        newCluster->interval = newCluster->start.start
+	  - (clusters ? history[(clusters - 1) % kept()].end.end - 1 : 1);
         // store cluster
-        cluster.push_back(newCluster);
+        history[clusters++ % kept()] = *newCluster;
+  }
+
+  void save(bool silenceOpen, bool clusterOpen) const
+  // Prints what detection needs to resume: the last silence & cluster and any being built.
+  // Must correlate with restore() & silencedetect.py
+  {
+    printf(" %d %llu %d %llu %d %llu %llu %.17g %d %llu %llu %llu %llu %u",
+           anySilence, anySilence ? lastSilence.end : 0,
+           clusters > 0, clusters ? history[(clusters - 1) % kept()].end.end : 0,
+           silenceOpen, silenceOpen ? active.start : 0, silenceOpen ? active.end : 0,
+           silenceOpen ? active.power : 0,
+           clusterOpen, clusterOpen ? building.start.start : 0, clusterOpen ? building.start.end : 0,
+           clusterOpen ? building.end.start : 0, clusterOpen ? building.end.end : 0,
+           clusterOpen ? building.silenceCount : 0);
+  }
+
+  frameNumber_t restore(const char* state, Silence*& silence, Cluster*& cluster)
+  // Resumes from a frame count followed by the state printed by save().
+  // Returns the frame count & sets the silence & cluster being built
+  {
+    frameNumber_t frame, lastEnd, clusterEnd, start, end, firstStart, firstEnd, lastStart, lastStop;
+    int silences, completed, silenceOpen, clusterOpen;
+    double power;
+    unsigned count;
+    if (15 != sscanf(state, "%llu %d %llu %d %llu %d %llu %llu %lg %d %llu %llu %llu %llu %u",
+                     &frame, &silences, &lastEnd, &completed, &clusterEnd,
+                     &silenceOpen, &start, &end, &power,
+                     &clusterOpen, &firstStart, &firstEnd, &lastStart, &lastStop, &count))
+      error("Could not parse resume state");
+    // only the ends of the last silence & cluster are needed, for intervals
+    anySilence = silences;
+    lastSilence = Silence::span(lastEnd, lastEnd, 0);
+    clusters = completed ? 1 : 0;
+    history[0].end = Silence::span(clusterEnd, clusterEnd, 0);
+    silence = NULL;
+    if (silenceOpen)
+      {
+        active = Silence::span(start, end, power);
+        silence = &active;
+      }
+    cluster = NULL;
+    if (clusterOpen)
+      {
+        building = Cluster(Silence::span(firstStart, firstEnd, 0));
+        building.resume(Silence::span(lastStart, lastStop, 0), count);
+        cluster = &building;
+      }
+    return frame;
   }
 };
 
+frameNumber_t frames = 0; // number of frames processed
 Silence* currentSilence; // the silence currently being detected/built
 Cluster* currentCluster; // the cluster currently being built
 ClusterList* clist;      // List of completed silences & clusters
@@ -272,14 +534,201 @@ void report(const char* err,
             const int power)
 // Logs silences/clusters/cuts in a standard format
 {
+  if (!logging(err))
+    return;
+
   frameCount_t duration = end - start + 1;
 
-  printf("%s%c %7s %6d-%6d (%3d:%02ld-%3d:%02ld), %4d (%2d:%04.1f), %5d (%3d:%02ld), [%7d]\n",
-	 err, type, msg1, start, end,
-	 (start+13) / Arg::krateInMins, lrint(start / Arg::kvideoRate) % 60,
-	 (end+13) / Arg::krateInMins, lrint(end / Arg::kvideoRate) % 60,
-	 duration, (duration+1) / Arg::krateInMins, fmod(duration / Arg::kvideoRate, 60),
-	 interval, (interval+13) / Arg::krateInMins, lrint(interval / Arg::kvideoRate) % 60, power);
+  // frames are printed signed, so a cut padded back past frame 0 shows as negative
+  printf("%s%c %7s %6lld-%6lld (%3lld:%02ld-%3lld:%02ld), %4lld (%2lld:%04.1f), %5lld (%3lld:%02ld), [%7d]\n",
+	 err, type, msg1, (long long)start, (long long)end,
+	 (long long)((start+Arg::rateRound) / Arg::rateInMins), lrint(start / Arg::videoRate) % 60,
+	 (long long)((end+Arg::rateRound) / Arg::rateInMins), lrint(end / Arg::videoRate) % 60,
+	 (long long)duration, (long long)((duration+1) / Arg::rateInMins), fmod(duration / Arg::videoRate, 60),
+	 (long long)interval, (long long)((interval+Arg::rateRound) / Arg::rateInMins),
+	 lrint(interval / Arg::videoRate) % 60, power);
+
+  // the wrapper acts on cuts immediately, other lines can wait
+  if (err == prefixcut)
+    fflush(stdout);
+}
+
+namespace Record
+// Fixed size binary records for the python wrapper, written alongside the text log
+{
+  enum kind_t {silence = 1, cluster = 2, cut = 3, progress = 4};
+
+  struct record_t             // must correlate with python wrapper
+  {
+    uint16_t kind;            // kind_t
+    uint16_t state;           // Silence/Cluster state_t
+    uint32_t count;           // silences in a cluster
+    uint64_t start;           // first frame
+    uint64_t end;             // last frame
+    double power;             // average level of a silence
+  };
+
+  FILE* stream = NULL;
+
+  void open()
+  {
+    if (Arg::recordFd >= 0 && NULL == (stream = fdopen(Arg::recordFd, "wb")))
+      error("Could not open record fd");
+  }
+
+  void write(kind_t kind, unsigned state, frameNumber_t start, frameNumber_t end,
+             unsigned count = 0, double power = 0)
+  {
+    if (NULL == stream)
+      return;
+    const record_t r = {static_cast<uint16_t>(kind), static_cast<uint16_t>(state), count, start, end, power};
+    fwrite(&r, sizeof(r), 1, stream);
+    // cuts & progress are needed by the wrapper immediately
+    if (cut == kind || progress == kind)
+      fflush(stream);
+  }
+
+  void close()
+  {
+    if (stream)
+      fclose(stream);
+  }
+}
+
+namespace Profile
+// Level of every frame in hundredths of a dB, so detection can be re-run without decoding
+{
+  struct header_t             // must correlate with silencedetect.py & silence.py
+  {
+    char magic[4];            // "SLNC"
+    uint32_t version;
+    uint32_t rateNum;         // video frame rate
+    uint32_t rateDen;
+    uint32_t flags;           // 1 = RMS levels
+    uint32_t channels;        // channels the levels are averaged over
+    uint64_t sourceSize;      // recording measured, filled in by the wrapper (0 = unknown)
+    int64_t sourceMtime;
+  };
+
+  const size_t kBlock = 4096; // levels compressed at a time
+  gzFile file = NULL;
+  uint16_t block[kBlock];
+  size_t filled = 0;
+
+  void open(unsigned channels)
+  // Once the input's channels are known
+  {
+    if (NULL == Arg::profilePath)
+      return;
+    if (NULL == (file = gzopen(Arg::profilePath, "wb")))
+      error("Could not open profile");
+    const header_t h = {{'S', 'L', 'N', 'C'}, 2, Arg::rateNum, Arg::rateDen, Arg::useRms ? 1u : 0u,
+                        channels, 0, 0};
+    gzwrite(file, &h, sizeof(h));
+  }
+
+  uint16_t quantise(double level)
+  // Hundredths of a dB below full scale, 65535 for no signal
+  {
+    if (level <= 0)
+      return 65535;
+    const double q = rint(-2000 * log10(level / INT_MAX));
+    return q < 0 ? 0 : q > 65534 ? 65534 : q;
+  }
+
+  void flush()
+  {
+    if (filled && gzwrite(file, block, filled * sizeof(block[0])) <= 0)
+      error("Could not write profile");
+    filled = 0;
+  }
+
+  void add(double level)
+  {
+    if (NULL == file)
+      return;
+    block[filled++] = quantise(level);
+    if (kBlock == filled)
+      flush();
+  }
+
+  void close()
+  {
+    if (NULL == file)
+      return;
+    flush();
+    if (Z_OK != gzclose(file))
+      error("Could not close profile");
+  }
+}
+
+namespace Adaptive
+// Threshold that follows the programme: a margin above its quietest frames but well below its median.
+// Levels are counted in a histogram of 0.25dB bins, halved regularly to forget old audio,
+// so the cost per frame & the memory are constant however long the input.
+// Must correlate with silencedetect.py
+{
+  const unsigned kPerDb = 4;              // bins per dB
+  const int kBins = 120 * kPerDb;         // 0 to -120dB, quieter levels share the last bin
+  const int kHeadroom = 20 * kPerDb;      // the threshold stays this far below the median
+  const unsigned kFloor = 1000;           // 1 in this many frames are below the noise floor
+  const frameCount_t kUpdate = 16;        // frames between threshold updates
+  const frameCount_t kDecay = 32768;      // frames between halving the counts
+
+  int margin = 0;                         // bins above the floor (0 = fixed threshold)
+  unsigned edge[kBins];                   // loudest level of each bin
+  unsigned long long count[kBins] = {0};
+  unsigned long long total = 0;           // levels counted
+  frameCount_t seen = 0;                  // frames added, for the warmup
+
+  void init()
+  {
+    margin = rint(Arg::adaptMargin * kPerDb);
+    for (int b = 0; b < kBins; b++)
+      edge[b] = rint(INT_MAX * pow(10.0, -static_cast<double>(b) / (20 * kPerDb)));
+  }
+
+  void update()
+  // Set the threshold from the counts
+  {
+    // walk from the quiet end to the floor & then the median
+    unsigned long long below = 0;
+    int floor = -1, median = 0;
+    for (int b = kBins - 1; b >= 0; b--)
+      {
+        below += count[b];
+        if (floor < 0 && below > total / kFloor)
+          floor = b;
+        if (below > total / 2)
+          {
+            median = b;
+            break;
+          }
+      }
+    const int bin = std::max(floor - margin, median + kHeadroom);
+    Arg::useThreshold = edge[std::min(std::max(bin, 1), kBins - 1)];
+  }
+
+  void add(double level)
+  // Count the level of the next frame, adapting the threshold for the frames that follow
+  {
+    if (0 == margin)
+      return;
+    // levels no louder than an edge belong to its bin or a quieter one
+    count[std::upper_bound(edge + 1, edge + kBins, level, std::greater<double>()) - (edge + 1)]++;
+    total++;
+    if (++seen % kUpdate)
+      return;
+    if (0 == seen % kDecay)
+      {
+        total = 0;
+        for (int b = 0; b < kBins; b++)
+          total += count[b] /= 2;
+      }
+    // frames per minute of warmup at the preset threshold
+    if (seen >= Arg::rateInMins)
+      update();
+  }
 }
 
 void processSilence()
@@ -289,7 +738,6 @@ void processSilence()
   if (currentSilence->state == Silence::detection && currentSilence->length < Arg::useMinQuiet)
     {
       // throw it away
-      delete currentSilence;
       currentSilence = NULL;
     }
   else
@@ -301,25 +749,27 @@ void processSilence()
       if (currentCluster)
         {
 	  // add to existing cluster
-	  currentCluster->extend(currentSilence);
+	  currentCluster->extend(*currentSilence);
         }
       else if (currentSilence->interval <= Arg::useMaxSep) // only possible for very first silence
         {
 	  // First silence is close to prog start so extend cluster to the start
 	  // by inserting a fake silence at prog start and starting the cluster there
-	  currentCluster = new Cluster(clist->insertStartSilence());
-	  currentCluster->extend(currentSilence);
+	  currentCluster = clist->newCluster(clist->startSilence());
+	  currentCluster->extend(*currentSilence);
         }
       else
         {
 	  // this silence is the start of a new cluster
-	  currentCluster = new Cluster(currentSilence);
+	  currentCluster = clist->newCluster(*currentSilence);
         }
       report(prefixdebug, currentSilence->state_log[currentSilence->state], "Silence",
 	     currentSilence->start, currentSilence->end,
 	     currentSilence->interval, currentSilence->power);
+      Record::write(Record::silence, currentSilence->state, currentSilence->start, currentSilence->end,
+                    0, currentSilence->power);
 
-      // silence is now owned by the list, start looking for next
+      // silence is now recorded by the list, start looking for next
       currentSilence = NULL;
     }
 }
@@ -331,31 +781,339 @@ void processCluster()
   clist->addCluster(currentCluster);
 
   report(prefixinfo, currentCluster->state_log[currentCluster->state], "Cluster",
-	 currentCluster->start->start, currentCluster->end->end,
+	 currentCluster->start.start, currentCluster->end.end,
 	 currentCluster->interval, currentCluster->silenceCount);
+  Record::write(Record::cluster, currentCluster->state, currentCluster->start.start,
+                currentCluster->end.end, currentCluster->silenceCount);
 
   // only flag clusters at final state
   if (currentCluster->state > Cluster::unset) {
     if (!Arg::onlyCutPreroll || (currentCluster->state == Cluster::preroll)) {
       report(prefixcut, '=', "Cut", currentCluster->padStart, currentCluster->padEnd, 0, 0);
+      Record::write(Record::cut, currentCluster->state, currentCluster->padStart, currentCluster->padEnd);
     }
   }
 
-  // cluster is now owned by the list, start looking for next
+  // cluster is now recorded by the list, start looking for next
   currentCluster = NULL;
+
+  // a stream may run for days: don't hold its log back until the buffer fills
+  if (Arg::streamFrames)
+    fflush(stdout);
+}
+
+void processProgress()
+// Report the frames processed so far & the state to resume from, so the wrapper can checkpoint
+{
+  printf("%s%llu", prefixprogress, frames);
+  clist->save(currentSilence != NULL, currentCluster != NULL);
+  printf("\n");
+  fflush(stdout);
+  Record::write(Record::progress, currentCluster ? currentCluster->state : Cluster::unset,
+                frames, frames, currentCluster ? currentCluster->silenceCount : 0);
+}
+
+void processLevel(double avgabs)
+// Classify the average audio level of the next frame
+{
+  frames++;
+  Profile::add(avgabs);
+
+  // check for a silence
+  if (avgabs < Arg::useThreshold)
+    {
+      if (currentSilence)
+        {
+          // extend current silence
+          currentSilence->extend(frames, avgabs);
+        }
+      else // transition to silence
+        {
+          // start a new silence
+          currentSilence = clist->newSilence(frames, avgabs);
+        }
+    }
+  else if (currentSilence) // transition out of silence
+    {
+      processSilence();
+    }
+  // in noise: check for cluster completion
+  else if (currentCluster && frames > currentCluster->completesAt)
+    {
+      processCluster();
+    }
+  Adaptive::add(avgabs);
+
+  if (Arg::streamFrames && 0 == frames % Arg::streamFrames)
+    processProgress();
+}
+
+void processEnd()
+// Complete detection at the end of the input
+{
+  // Complete any current silence (prog may have finished in silence)
+  if (currentSilence)
+    {
+      processSilence();
+    }
+  // extend any cluster close to prog end
+  if (currentCluster && frames <= currentCluster->completesAt)
+    {
+      // generate a silence at prog end and extend cluster to it
+      currentSilence = clist->newSilence(frames, 0, Silence::progEnd);
+      processSilence();
+    }
+  // Complete any final cluster
+  if (currentCluster)
+    {
+      processCluster();
+    }
+}
+
+class FrameMeter
+// Averages sample magnitudes (or RMS) over the audio of each video frame
+{
+private:
+  const unsigned rate;       // sample rate
+  const unsigned channels;   // channels the average is taken over
+  unsigned long long frame;  // frames completed
+  size_t window;             // samples per channel in the current frame
+  size_t filled;             // samples per channel accumulated for the current frame
+  unsigned long long isum;   // sum of integer magnitudes
+  double dsum;               // sum of other magnitudes, or of squares in RMS mode
+
+public:
+  static const unsigned kBlockSeconds = 4; // audio read at a time by the AU path
+
+  FrameMeter(unsigned _rate, unsigned _channels)
+  // Starts at the next frame to be processed, which is only past 0 when resuming
+    : rate(_rate), channels(_channels), frame(frames),
+      window(Arg::frameStart(_rate, frames + 1) - Arg::frameStart(_rate, frames)),
+      filled(0), isum(0), dsum(0) {}
+
+  size_t room() const
+  // Samples per channel still needed to complete the current frame
+  {
+    return window - filled;
+  }
+
+  void add(size_t count, unsigned long long _isum, double _dsum)
+  // Accumulate sums (32-bit sample scale) of <count> samples per channel,
+  // completing the frame if full
+  {
+    isum += _isum;
+    dsum += _dsum;
+    filled += count;
+    if (filled == window)
+      {
+        const size_t samples = window * channels;
+        if (Arg::useRms)
+          processLevel(sqrt(dsum / samples));
+        else
+          processLevel(isum / samples + dsum / samples);
+        filled = isum = 0;
+        dsum = 0;
+        // fractional frame rates give frames of varying length
+        frame++;
+        window = Arg::frameStart(rate, frame + 1) - Arg::frameStart(rate, frame);
+      }
+  }
+
+  void addInt32(const int* s, size_t count, unsigned interleaved)
+  // Accumulate <count> samples per channel of interleaved 32-bit audio,
+  // completing as many frames as they fill
+  {
+    while (count)
+      {
+        const size_t take = std::min(room(), count);
+        const size_t n = take * interleaved;
+        if (Arg::useRms)
+          add(take, 0, Energy::sqInt32(s, n));
+        else
+          add(take, Energy::absInt32(s, n), 0);
+        s += n;
+        count -= take;
+      }
+  }
+};
+
+#ifdef HAVE_LIBAV
+unsigned frameChannels(const AVFrame* frame)
+{
+#if LIBAVUTIL_VERSION_INT >= AV_VERSION_INT(57, 28, 100)
+  return frame->ch_layout.nb_channels;
+#else
+  return frame->channels;
+#endif
+}
+
+template <typename T>
+void sumOther(const T* s, size_t n, double scale, unsigned long long& isum, double& dsum)
+// Sums for sample formats without a vectorised kernel, scaled to 32 bits
+{
+  for (size_t i = 0; i < n; i++)
+    {
+      const double x = s[i] * scale;
+      if (Arg::useRms)
+        dsum += x * x;
+      else
+        dsum += fabs(x);
+    }
+}
+
+void meterFrame(FrameMeter& meter, const AVFrame* frame)
+// Measure a decoded audio frame in its native sample format
+{
+  const AVSampleFormat format = static_cast<AVSampleFormat>(frame->format);
+  const unsigned channels = frameChannels(frame);
+  const bool planar = av_sample_fmt_is_planar(format);
+  const unsigned bytes = av_get_bytes_per_sample(format);
+  // planar: one plane per channel, interleaved: all channels contiguous in plane 0
+  const unsigned planes = planar ? channels : 1;
+  const unsigned width = planar ? 1 : channels;
+
+  size_t done = 0;
+  while (done < static_cast<size_t>(frame->nb_samples))
+    {
+      const size_t take = std::min(meter.room(), frame->nb_samples - done);
+      const size_t n = take * width;
+      unsigned long long isum = 0;
+      double dsum = 0;
+      for (unsigned p = 0; p < planes; p++)
+        {
+          const uint8_t* data = frame->extended_data[p] + done * width * bytes;
+          switch (format)
+            {
+            case AV_SAMPLE_FMT_S32:
+            case AV_SAMPLE_FMT_S32P:
+              if (Arg::useRms)
+                dsum += Energy::sqInt32(reinterpret_cast<const int*>(data), n);
+              else
+                isum += Energy::absInt32(reinterpret_cast<const int*>(data), n);
+              break;
+            case AV_SAMPLE_FMT_FLT:
+            case AV_SAMPLE_FMT_FLTP:
+              if (Arg::useRms)
+                dsum += Energy::sqFloat(reinterpret_cast<const float*>(data), n) * INT_MAX * INT_MAX;
+              else
+                dsum += Energy::absFloat(reinterpret_cast<const float*>(data), n) * INT_MAX;
+              break;
+            case AV_SAMPLE_FMT_S16:
+            case AV_SAMPLE_FMT_S16P:
+              sumOther(reinterpret_cast<const int16_t*>(data), n, 65536.0, isum, dsum);
+              break;
+            case AV_SAMPLE_FMT_DBL:
+            case AV_SAMPLE_FMT_DBLP:
+              sumOther(reinterpret_cast<const double*>(data), n, INT_MAX, isum, dsum);
+              break;
+            default:
+              error("Unsupported sample format");
+            }
+        }
+      meter.add(take, isum, dsum);
+      done += take;
+    }
+}
+
+void decodeNative()
+// Decode the main audio stream of a recording on stdin and measure it
+{
+  AVFormatContext* format = NULL;
+  if (avformat_open_input(&format, "pipe:0", NULL, NULL) < 0)
+    error("libav could not open input");
+  if (avformat_find_stream_info(format, NULL) < 0)
+    error("libav could not find stream info");
+
+#if LIBAVFORMAT_VERSION_MAJOR < 59
+  AVCodec* codec = NULL;
+#else
+  const AVCodec* codec = NULL;
+#endif
+  const int stream = av_find_best_stream(format, AVMEDIA_TYPE_AUDIO, -1, -1, &codec, 0);
+  if (stream < 0)
+    error("No audio stream found");
+
+  AVCodecContext* context = avcodec_alloc_context3(codec);
+  if (NULL == context
+      || avcodec_parameters_to_context(context, format->streams[stream]->codecpar) < 0
+      || avcodec_open2(context, codec, NULL) < 0)
+    error("libav could not open audio decoder");
+
+  AVPacket* packet = av_packet_alloc();
+  AVFrame* frame = av_frame_alloc();
+  if (NULL == packet || NULL == frame)
+    error("Couldn't allocate memory");
+
+  // meter is created from the first frame as stream info may be incomplete
+  FrameMeter* meter = NULL;
+  bool more = true;
+  while (more)
+    {
+      more = av_read_frame(format, packet) >= 0;
+      if (more && packet->stream_index != stream)
+        {
+          av_packet_unref(packet);
+          continue;
+        }
+      // a NULL packet flushes the decoder at end of input. Corrupt packets are skipped
+      if (avcodec_send_packet(context, more ? packet : NULL) >= 0)
+        while (avcodec_receive_frame(context, frame) >= 0)
+          {
+            if (NULL == meter)
+              {
+                const unsigned channels = Arg::refChannels ? Arg::refChannels : frameChannels(frame);
+                meter = new FrameMeter(frame->sample_rate, channels);
+                Profile::open(channels);
+              }
+            meterFrame(*meter, frame);
+          }
+      av_packet_unref(packet);
+    }
+
+  delete meter;
+  av_frame_free(&frame);
+  av_packet_free(&packet);
+  avcodec_free_context(&context);
+  avformat_close_input(&format);
 }
+#endif
 
 int main(int argc, char **argv)
 // Detect silences and allocate to clusters
 {
   // Remove logging prefixes if writing to terminal
   if (isatty(1))
-    prefixcut[0] = prefixinfo[0] = prefixdebug[0] = prefixerr[0] = '\0';
+    prefixcut[0] = prefixinfo[0] = prefixdebug[0] = prefixerr[0] = prefixprogress[0] = '\0';
 
-  // flush output buffer after every line
-  setvbuf(stdout, NULL, _IOLBF, 0);
+  // buffer output, cuts & progress are flushed as they are reported
+  setvbuf(stdout, NULL, _IOFBF, BUFSIZ);
 
   Arg::parse(argc, argv);
+  Adaptive::init();
+  const char* kernels = Energy::select();
+  if (logging(prefixdebug))
+    printf("%sUsing %s energy kernels\n", prefixdebug, kernels);
+  Record::open();
+
+  // create silence/cluster list
+  clist = new ClusterList();
+  if (Arg::resumeState)
+    frames = clist->restore(Arg::resumeState, currentSilence, currentCluster);
+
+  if (Arg::nativeDecode)
+    {
+      if (Arg::resumeState)
+        error("Resuming needs AU input");
+#ifdef HAVE_LIBAV
+      decodeNative();
+      processEnd();
+      Record::close();
+      Profile::close();
+      return 0;
+#else
+      error("Native decoding requires silence to be built with libav (make LIBAV=1)");
+#endif
+    }
 
   /* Check the input is an audiofile. */
   SF_INFO metadata;
@@ -365,76 +1123,48 @@ int main(int argc, char **argv)
     error(sf_strerror(NULL));
   }
 
-  /* Allocate data buffer to contain audio data from one video frame. */
-  const size_t frameSamples = metadata.channels * metadata.samplerate / Arg::kvideoRate;
-
-  int* samples = (int*)malloc(frameSamples * sizeof(int));
+  /* Allocate data buffer to contain a block of audio data. */
+  const size_t blockSamples = static_cast<size_t>(metadata.samplerate) * FrameMeter::kBlockSeconds;
+  int* samples = (int*)malloc(blockSamples * metadata.channels * sizeof(int));
   if (NULL == samples)
     error("Couldn't allocate memory");
-
-  // create silence/cluster list
-  clist = new ClusterList();
+  const unsigned channels = Arg::refChannels ? Arg::refChannels : metadata.channels;
+  FrameMeter meter(metadata.samplerate, channels);
+  Profile::open(channels);
 
   // Kill head of pipeline if timeout happens.
+  if (0 == tail_pid)
+    idleTimeout = 0; // nothing to kill: input ends when the writer closes the pipe
   signal(SIGALRM, watchdog);
   sigset_t intmask;
   sigemptyset(&intmask);
   sigaddset(&intmask, SIGALRM);
   sigprocmask(SIG_UNBLOCK, &intmask, NULL);
-  alarm(30);
+  alarm(idleTimeout);
 
-  // Process the input one frame at a time and process cuts along the way.
-  frameNumber_t frames = 0;
-  while (frameSamples == static_cast<size_t>(sf_read_int(input, samples, frameSamples)))
+  // Resumed input starts before the first frame to process: skip to it
+  sf_count_t got;
+  const unsigned long long first = Arg::frameStart(metadata.samplerate, frames);
+  if (first < Arg::startSample)
+    error("Input starts after the resume frame");
+  for (unsigned long long skip = first - Arg::startSample; skip; skip -= got / metadata.channels)
     {
-      alarm(30);
-      frames++;
-
-      // determine average audio level in this frame
-      unsigned long long avgabs = 0;
-      for (unsigned i = 0; i < frameSamples; i++)
-	avgabs += abs(samples[i]);
-      avgabs = avgabs / frameSamples;
-
-      // check for a silence
-      if (avgabs < Arg::useThreshold)
-        {
-	  if (currentSilence)
-            {
-	      // extend current silence
-	      currentSilence->extend(frames, avgabs);
-            }
-	  else // transition to silence
-            {
-	      // start a new silence
-	      currentSilence = new Silence(frames, avgabs);
-            }
-        }
-      else if (currentSilence) // transition out of silence
-        {
-	  processSilence();
-        }
-      // in noise: check for cluster completion
-      else if (currentCluster && frames > currentCluster->completesAt)
-        {
-	  processCluster();
-        }
+      got = sf_read_int(input, samples, std::min<unsigned long long>(skip, blockSamples) * metadata.channels);
+      alarm(idleTimeout);
+      if (got <= 0)
+        break;
     }
-  // Complete any current silence (prog may have finished in silence)
-  if (currentSilence)
-    {
-      processSilence();
-    }
-  // extend any cluster close to prog end
-  if (currentCluster && frames <= currentCluster->completesAt)
-    {
-      // generate a silence at prog end and extend cluster to it
-      currentSilence = new Silence(frames, 0, Silence::progEnd);
-      processSilence();
-    }
-  // Complete any final cluster
-  if (currentCluster)
+
+  // Process the input a block at a time and process cuts along the way.
+  // A short read means end of input: any incomplete final frame is ignored.
+  do
     {
-      processCluster();
+      got = sf_read_int(input, samples, blockSamples * metadata.channels);
+      alarm(idleTimeout);
+      meter.addInt32(samples, got / metadata.channels, metadata.channels);
     }
+  while (static_cast<size_t>(got) == blockSamples * metadata.channels);
+  processEnd();
+  Record::close();
+  Profile::close();
 }
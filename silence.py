@@ -9,18 +9,84 @@
 # v4.2 Prevent BE writeStringList errors
 # v5.0 Improve exception handling/logging. Fix player messages (0.26+ only)
 # v5.1 explicity set the bookmarkupdate value (for newer mysql)
+# v5.2 Buffer cuts and write them to the database in bulk
+# v5.3 Build skiplist updates for MythPlayers from a locally sorted cut list
+# v6.0 Stream the recording from Python instead of tail, finish when the recorder does
+# v6.1 Use inotify to detect the end of recording, idle timeout is only a fallback
+# v6.2 Optionally let silence decode the recording itself (needs silence built with libav)
+# v6.3 Optional downmix mode: native channels at a low sample rate instead of a 6 channel upmix
+# v8.2 --downmix keeps the source rate so that levels, and presets, match the upmix exactly
+# v8.3 Profiles identify their recording & measurement; --cached decodes if they don't match
+# v6.4 Pass the recording's frame rate to silence instead of assuming 25 fps
+# v6.5 Optionally snap cuts to keyframes from the seek table
+# v7.0 Optional in-process NumPy detector (silencedetect.py) instead of silence
+# v7.1 Optionally read cuts from silence as binary records on a separate pipe
+# v7.2 Tell the detector the log level so it doesn't format unwanted lines
+# v7.3 Parse preset files once into a single regex, re-read only when modified
+# v7.4 Add --daemon to run jobs handed over by silencejob.py on warm connections
+# v7.5 Accept several jobids. Limit concurrent decoders by cores & load, watched recordings first
+# v7.6 Flag finished recordings in batch: ffmpeg reads the file, one skiplist update & transaction
+# v7.7 Optionally decode finished recordings in parallel segments (--segments), needs NumPy
+# v7.8 Save level profiles next to recordings (--profile) & re-flag from them (--cached)
+# v7.9 Run the detector as a stream when following a recording, reading its progress
+# v8.0 Checkpoint followed recordings so a restarted job resumes, keeping its cuts
+# v8.1 Optional adaptive threshold (--adaptive) that follows the programme's noise floor
 
 import MythTV
 import os
 import subprocess
 import argparse
+import bisect
 import collections
 import re
 import sys
 import datetime
+import time
+import threading
+import ctypes
+import ctypes.util
+import select
+import struct
+import socketserver
+import socket
+import stat
+import json
+import gzip
+import fractions
+import math
+import itertools
+import concurrent.futures
 
 kExe_Silence = '/usr/local/bin/silence'
 kUpmix_Channels = '6' # Change this to 2 if you never have surround sound in your recordings.
+kDefault_Rate = '25'   # frame rate used if the recording's can't be determined
+kMark_Video_Rate = 32  # markup type holding frame rate * 1000
+kMark_Gop_Byframe = 9  # seek table type holding keyframe numbers
+
+# Binary records from silence -b: kind, state, count, start, end, power
+kRecord = struct.Struct('=HHIQQd')  # must correlate with silence.cpp record_t
+kRecord_Cut = 3
+kRecord_Progress = 4
+kChunk_Size = 1 << 20 # bytes read from the recording at a time (multiple of the page size)
+kPoll_Interval = 1.0  # seconds to wait for a growing recording before reading again
+kIdle_Timeout = 30    # default seconds without file activity before asking the backend
+
+# Recorder states that mean the file is still being written
+kRecording_Status = (-14, -10, -2)  # rsFailing, rsTuning, rsRecording
+kSocket_Path = '~/.mythtv/silence.sock'  # in our own directory, must correlate with silencejob.py
+kSchedule_Interval = 5.0  # seconds between re-checking the priority & load of waiting jobs
+kSegment_Overlap = 2.0    # seconds decoded before each segment so the decoder has settled
+kSegment_Check = 1.0      # seconds of frames before each segment measured by both decoders
+kSegment_Min = 60.0       # shortest segment worth a decoder, in seconds
+kProfile_Suffix = '.silence.gz'  # level profile saved next to the recording
+# Profile header: magic, version, frame rate, flags, channels, source size & mtime
+kProfile_Header = struct.Struct('<4sIIIIIQq')  # must correlate with silence.cpp Profile::header_t
+kProfile_Version = 2
+kProgress_Interval = 60.0  # seconds of a followed recording between detector progress reports
+kCheckpoint_Suffix = '.silence.ckpt'  # checkpoint saved next to the recording
+kCheckpoint_Lag = 2     # progress reports between a checkpoint's byte offset & its frame
+kResume_Margin = 2.0    # seconds decoded before the frame a job resumes from
+kTS_Packet = 188        # resumed input starts at a whole transport stream packet
 
 class MYLOG(MythTV.MythLog):
   "A specialised logger"
@@ -34,6 +100,122 @@ class MYLOG(MythTV.MythLog):
     # prepend string to msg so that rsyslog routes it to mythcommflag.log logfile
     MythTV.MythLog.log(self, MythTV.MythLog.COMMFLAG, level, 'mythcommflag: ' + msg.rstrip('\n'))
 
+# log levels of detector output prefixes
+kLevel = {'cut': MYLOG.INFO, 'info': MYLOG.INFO, 'debug': MYLOG.DEBUG, 'err': MYLOG.ERR,
+          'progress': MYLOG.DEBUG}
+
+def parseLine(line):
+  "Splits a detector log line into (flag, info, cut); cut is (start, end) for cut lines"
+  flag, info = line.split('@', 1)
+  cut = None
+  if flag == 'cut':
+    # extract numbers from log line
+    numbers = re.findall(r'\d+', info)
+    cut = (int(numbers[0]), int(numbers[1]))
+  return flag, info, cut
+
+def readRecords(fd):
+  "Generates (flag, info, cut) for the cuts & progress in silence's binary records"
+  data = b''
+  while True:
+    chunk = os.read(fd, 65536)
+    if not chunk:
+      break
+    data += chunk
+    whole = len(data) - len(data) % kRecord.size
+    for kind, state, count, start, end, power in kRecord.iter_unpack(data[:whole]):
+      if kind == kRecord_Cut:
+        yield 'cut', None, (start, end)  # the text log reports the cut
+      elif kind == kRecord_Progress:
+        yield 'progress', str(start), None
+    data = data[whole:]
+
+class LOGREADER(threading.Thread):
+  "Logs the text output of the detector when cuts are read from its binary records"
+
+  def __init__(self, stream, logger):
+    threading.Thread.__init__(self, name='logreader')
+    self.daemon = True
+    self.stream = stream
+    self.logger = logger
+
+  def run(self):
+    for line in self.stream:
+      flag, info, cut = parseLine(line.decode('utf-8'))
+      self.logger.log(info, kLevel.get(flag, MYLOG.WARNING))
+
+
+def detectorLogLevel():
+  "Returns the detector log level (0 = errors & cuts, 1 = info, 2 = debug) for our log level"
+  if MYLOG._LEVEL >= MYLOG.DEBUG:
+    return 2
+  if MYLOG._LEVEL >= MYLOG.INFO:
+    return 1
+  return 0
+
+
+class PRESETFILE:
+  "A preset file parsed once & compiled into a single regex, cached until the file changes"
+
+  cache = {}  # filename -> PRESETFILE
+
+  def __init__(self, filename, mtime, logger):
+    "Parse preset lines & compile their names"
+    self.filename = filename
+    self.mtime = mtime
+    self.entries = []  # (line, values, pattern) in file order
+    with open(filename) as presets:
+      for rawline in presets:
+        line = rawline.strip()
+        if line and (not line.startswith('#')):  # ignore empty & comment lines
+          vals = [i.strip() for i in line.split(',')]  # split individual params
+          try:
+            pattern = re.compile(vals[0], re.IGNORECASE)
+          except re.error as e:
+            logger.log('Preset "' + vals[0] + '" is not a valid expression (' + str(e) + ') - ignored',
+              MYLOG.ERR)
+            continue
+          self.entries.append((line, vals[1:], pattern))
+    # names are matched at the start so an alternation of them, tried in file order,
+    # finds the first matching line in one pass. Names with their own groups could
+    # be renumbered by this so those files are matched line by line, as are names
+    # that are only valid on their own, such as those starting with a flag like (?i)
+    self.combined = None
+    if not any(p.groups for l, v, p in self.entries):
+      try:
+        self.combined = re.compile('|'.join('(?P<_%d>%s)' % (i, p.pattern)
+                          for i, (l, v, p) in enumerate(self.entries)), re.IGNORECASE)
+      except re.error as e:
+        logger.log('Matching presets line by line: %s' % e, MYLOG.DEBUG)
+
+  @classmethod
+  def load(cls, filename, logger):
+    "Returns the parsed file, re-reading it only if it has been modified"
+    mtime = os.stat(filename).st_mtime
+    presets = cls.cache.get(filename)
+    if presets is None or presets.mtime != mtime:
+      logger.log('Parsing preset file "' + filename + '"', MYLOG.DEBUG)
+      presets = cls.cache[filename] = cls(filename, mtime, logger)
+    return presets
+
+  def _first(self, name):
+    "Returns index of first entry matching name or None"
+    if self.combined is not None:
+      m = self.combined.match(name)
+      return int(m.lastgroup[1:]) if m else None
+    for i, (line, vals, pattern) in enumerate(self.entries):
+      if pattern.match(name):
+        return i
+    return None
+
+  def match(self, title, callsign):
+    "Returns (line, values) of the first entry matching title or callsign or None"
+    found = [i for i in (self._first(title), self._first(callsign)) if i is not None]
+    if not found:
+      return None
+    line, vals, pattern = self.entries[min(found)]
+    return line, vals
+
 class PRESET:
   "Manages the presets (parameters passed to the detection algorithm)"
 
@@ -41,8 +223,6 @@ class PRESET:
   argname = ['thresh', 'minquiet', 'mindetect', 'minbreak', 'maxsep', 'pad', 'preroll']
   #argval  = [  -75,       0.16,        6,          120,       120,    0.48,      0]
   argval  = [  -88,       0.04,        3,          120,       120,    1,     0]
-  # dictionary holds value for each arg
-  argdict = collections.OrderedDict(list(zip(argname, argval)))
 
   def _validate(self, k, v):
     "Converts arg input from string to float or None if invalid/not supplied"
@@ -58,40 +238,35 @@ class PRESET:
   def __init__(self, _logger):
     "Initialise preset manager"
     self.logger = _logger
+    # dictionary holds value for each arg
+    self.argdict = collections.OrderedDict(list(zip(self.argname, self.argval)))
+
+  def _update(self, vals):
+    "Replaces default values with the valid supplied ones"
+    # convert supplied values to float & match to appropriate arg name
+    validargs = list(map(self._validate, self.argname, vals[0:len(self.argname)]))
+    # remove missing/invalid values from list & replace default values with the rest
+    self.argdict.update(v for v in validargs if v[1] is not None)
 
   def getFromArg(self, line):
     "Parses preset values from command-line string"
     self.logger.log('Parsing presets from "' + line + '"', MYLOG.DEBUG)
     if line:  # ignore empty string
-      vals = [i.strip() for i in line.split(',')]  # split individual params
-      # convert supplied values to float & match to appropriate arg name
-      validargs = list(map(self._validate, self.argname, vals[0:len(self.argname)]))
-      # remove missing/invalid values from list & replace default values with the rest
-      self.argdict.update(v for v in validargs if v[1] is not None)
+      self._update([i.strip() for i in line.split(',')])  # split individual params
 
   def getFromFile(self, filename, title, callsign):
     "Gets preset values from a file"
     self.logger.log('Using preset file "' + filename + '"', MYLOG.DEBUG)
     try:
-      with open(filename) as presets:
-        for rawline in presets:
-          line = rawline.strip()
-          if line and (not line.startswith('#')):  # ignore empty & comment lines
-            vals = [i.strip() for i in line.split(',')]  # split individual params
-            # match preset name to recording title or channel
-            pattern = re.compile(vals[0], re.IGNORECASE)
-            if pattern.match(title) or pattern.match(callsign):
-              self.logger.log('Using preset "' + line.strip() + '"')
-              # convert supplied values to float & match to appropriate arg name
-              validargs = list(map(self._validate, self.argname,
-                         vals[1:1 + len(self.argname)]))
-              # remove missing/invalid values from list &
-              # replace default values with the rest
-              self.argdict.update(v for v in validargs if v[1] is not None)
-              break
-        else:
-          self.logger.log('No preset found for "' + title + '" or "' + callsign + '"')
-    except IOError:
+      # match preset name to recording title or channel
+      found = PRESETFILE.load(filename, self.logger).match(title, callsign)
+      if found:
+        line, vals = found
+        self.logger.log('Using preset "' + line + '"')
+        self._update(vals)
+      else:
+        self.logger.log('No preset found for "' + title + '" or "' + callsign + '"')
+    except (IOError, OSError):
       self.logger.log('Presets file "' + filename + '" not found', MYLOG.ERR)
     return self.argdict
 
@@ -99,31 +274,594 @@ class PRESET:
     "Returns params as a list of strings"
     return [str(i) for i in list(self.argdict.values())]
 
+class MARKUPWRITER:
+  "Buffers commercial marks and writes them to the database in bulk"
 
-def main():
-  "Commflag a recording"
+  def __init__(self, db, rec, logger, maxcuts = 10, maxsecs = 60):
+    "Initialise writer. A window of 0 disables that flush trigger"
+    self.db = db
+    self.rec = rec
+    self.logger = logger
+    self.maxcuts = maxcuts
+    self.maxsecs = maxsecs
+    self.pending = []  # cuts not yet written
+    self.cuts = []     # all cuts seen this job, sorted
+    self.since = None  # time of oldest pending cut
+
+  def append(self, start, end):
+    "Queue a cut, flushing if the count or time window has been reached"
+    self.pending.append((start, end))
+    bisect.insort(self.cuts, (start, end))
+    if self.since is None:
+      self.since = time.time()
+    if self.maxcuts and len(self.pending) >= self.maxcuts:
+      self.flush()
+    else:
+      self.poll()
+
+  def poll(self):
+    "Flush if the oldest pending cut has waited longer than the time window"
+    if self.pending and self.maxsecs and time.time() - self.since >= self.maxsecs:
+      self.flush()
+
+  def _insert(self, cursor):
+    "Write all pending cuts in a single INSERT"
+    rows = []
+    for start, end in self.pending:
+      rows.append((self.rec.chanid, self.rec.starttime, start, self.rec.markup.MARK_COMM_START))
+      rows.append((self.rec.chanid, self.rec.starttime, end, self.rec.markup.MARK_COMM_END))
+    cursor.executemany('INSERT INTO recordedmarkup (chanid, starttime, mark, type) '
+                       'VALUES (%s, %s, %s, %s)', rows)
+    self.logger.log('Wrote %d cuts to database' % len(self.pending), MYLOG.DEBUG)
+    self.pending = []
+    self.since = None
+
+  def flush(self):
+    "Write all pending cuts"
+    if not self.pending:
+      return
+    with self.db as cursor:
+      self._insert(cursor)
+
+  def replace(self, cuts):
+    "Replace all commercial marks of the recording with a new list of cuts, in one transaction"
+    self.pending = list(cuts)
+    self.cuts = sorted(cuts)
+    with self.db as cursor:
+      cursor.execute('DELETE FROM recordedmarkup WHERE chanid=%s AND starttime=%s AND type IN (%s, %s)',
+                     (self.rec.chanid, self.rec.starttime,
+                      self.rec.markup.MARK_COMM_START, self.rec.markup.MARK_COMM_END))
+      if self.pending:
+        self._insert(cursor)
+
+
+class KEYFRAMES:
+  "Snaps cuts to keyframes using the recording's seek table"
+
+  def __init__(self, db, rec):
+    "Load keyframe positions from the seek table"
+    with db as cursor:
+      cursor.execute('SELECT mark FROM recordedseek WHERE chanid=%s AND starttime=%s AND type=%s '
+                     'ORDER BY mark', (rec.chanid, rec.starttime, kMark_Gop_Byframe))
+      self.frames = [row[0] for row in cursor.fetchall()]
+
+  def snap(self, start, end):
+    "Moves a cut inwards to keyframes so that no programme is skipped"
+    i = bisect.bisect_left(self.frames, start)  # first keyframe at/after start
+    j = bisect.bisect_right(self.frames, end)   # first keyframe after end
+    if i < len(self.frames) and j > 0 and self.frames[i] < self.frames[j - 1]:
+      return self.frames[i], self.frames[j - 1]
+    return start, end  # no keyframes inside the cut
+
+  def snapAll(self, cuts):
+    "Returns a list of snapped cuts, unchanged if there is no seek table"
+    if not self.frames:
+      return list(cuts)
+    return [self.snap(start, end) for start, end in cuts]
+
+class PLAYERUPDATE:
+  "Sends skiplist updates to MythPlayers via the backend"
+
+  def __init__(self, be, rec, progId, logger):
+    "Initialise updater"
+    self.be = be
+    self.rec = rec
+    self.progId = progId
+    self.logger = logger
+
+  def send(self, cuts):
+    "Send a COMMFLAG_UPDATE message with the complete skiplist. Players replace their break map with it"
+    skiplist = ['%d:%d,%d:%d'%(x, self.rec.markup.MARK_COMM_START, y, self.rec.markup.MARK_COMM_END)
+             for x, y in cuts]
+    mesg = 'COMMFLAG_UPDATE %s %s'%(self.progId, ','.join(skiplist))
+#   self.logger.log('  Sending %s'%mesg,  MYLOG.DEBUG)
+    result = self.be.backendCommand("MESSAGE[]:[]" + mesg)
+    if result != 'OK':
+      self.logger.log('Sending update message to backend failed, response = %s, message = %s'% (result, mesg), MYLOG.ERR)
+
+def recordingInProgress(be, chanid, starttime):
+  "Returns True whilst the backend is still writing the recording. Backend errors are raised, as the answer is unknown"
+  prog = be.getRecording(chanid, starttime)
+  return prog is not None and int(prog.recstatus) in kRecording_Status
+
+def recordingFinished(be, rec):
+  "Returns True if the recording ended in the past & the backend isn't still writing it"
+  try:
+    now = MythTV.datetime.now()  # 0.26+ times are timezone aware
+  except AttributeError:
+    now = datetime.datetime.now()
+  try:
+    if rec.endtime > now:
+      return False
+  except TypeError:
+    pass  # can't compare, ask the backend
+  try:
+    return not recordingInProgress(be, rec.chanid, rec.starttime)
+  except Exception:
+    return False  # follow it, a follower copes with the backend being unavailable
+
+def recordingWatched(db, chanid, starttime):
+  "Returns True if a player has the recording open"
+  with db as cursor:
+    cursor.execute('SELECT COUNT(*) FROM inuseprograms WHERE chanid=%s AND starttime=%s AND recusage=%s',
+                   (chanid, starttime, 'player'))
+    return cursor.fetchone()[0] > 0
+
+def markupRate(rate):
+  "Returns a frame rate stored as fps * 1000 as a fraction string, exact for NTSC rates such as 29970"
+  if rate % 1000 == 0:
+    return '%d' % (rate // 1000)
+  ntsc = int(round(rate * 1.001))  # eg. 30000 for 29970
+  if ntsc % 1000 == 0 and abs(ntsc / 1.001 - rate) < 1:
+    return '%d/1001' % ntsc
+  return '%d/1000' % rate
+
+def frameRate(filename, db, rec, logger):
+  "Returns the video frame rate of a recording as a fraction string for silence"
+  # the recorder stores the rate MythTV numbers frames with
+  with db as cursor:
+    cursor.execute('SELECT data FROM recordedmarkup WHERE chanid=%s AND starttime=%s AND type=%s',
+                   (rec.chanid, rec.starttime, kMark_Video_Rate))
+    row = cursor.fetchone()
+  if row and row[0]:
+    return markupRate(int(row[0]))
+  try:
+    # the average rate counts frames, r_frame_rate gives the field rate of interlaced H.264
+    rate = subprocess.check_output(["mythffprobe", "-v", "quiet", "-select_streams", "v:0",
+                                    "-show_entries", "stream=avg_frame_rate", "-of", "csv=p=0",
+                                    filename]).decode('utf-8').strip()
+    num, den = [int(i) for i in rate.split('/')]
+    if num > 0 and den > 0:
+      return '%d/%d' % (num, den)
+  except (OSError, subprocess.CalledProcessError, ValueError):
+    pass
+  logger.log('Frame rate unknown, assuming %s fps' % kDefault_Rate, MYLOG.WARNING)
+  return kDefault_Rate
+
+def frameRateValue(fps):
+  "Returns a frame rate string as a number"
+  num, den = (fps.split('/') + ['1'])[:2]
+  return float(num) / float(den)
+
+def progressFrames(fps):
+  "Returns the frames between detector progress reports for a frame rate string"
+  return max(int(round(frameRateValue(fps) * kProgress_Interval)), 1)
+
+def audioStart(filename):
+  "Returns the timestamp of a recording's first audio sample in seconds, & its sample rate"
+  info = json.loads(subprocess.check_output(["mythffprobe", "-v", "quiet", "-select_streams", "a:0",
+                                             "-show_entries", "stream=start_time,sample_rate",
+                                             "-of", "json", filename]).decode('utf-8'))
+  return float(info['streams'][0]['start_time']), int(info['streams'][0]['sample_rate'])
+
+def audioTimes(filename):
+  "Returns the duration of a recording & how far into it the audio starts, in seconds"
+  info = json.loads(subprocess.check_output(["mythffprobe", "-v", "quiet", "-select_streams", "a:0",
+                                             "-show_entries", "format=duration,start_time:stream=start_time",
+                                             "-of", "json", filename]).decode('utf-8'))
+  start = float(info['format']['start_time'])
+  return float(info['format']['duration']), float(info['streams'][0]['start_time']) - start
+
+def decodeSegment(filename, audio, params, delay, seek, frame, endFrame):
+  "Decodes a recording from <seek> seconds into its audio, returning the levels of frames <frame> to <endFrame>"
+  import numpy
+  import silencedetect
+  command = ["mythffmpeg", "-loglevel", "quiet"]
+  if seek:
+    # ffmpeg trims to the exact sample after seeking
+    command += ["-ss", "%.6f" % (delay + seek)]
+  p = subprocess.Popen(command + ["-i", filename, "-f", "au"] + audio + ["-"],
+                       stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+  try:
+    reader = silencedetect.AudioReader(p.stdout)
+    levels = list(silencedetect.frameLevels(reader, params, silencedetect.kBlock_Frames,
+                                            frame, int(round(seek * reader.rate)), endFrame))
+  finally:
+    p.kill()
+    p.wait()
+    p.stdout.close()
+  return numpy.concatenate(levels) if levels else numpy.zeros(0)
+
+def segmentedLevels(filename, audio, params, segments, logger):
+  "Decodes a finished recording in parallel segments, returning all frame levels or None to decode it serially"
+  import numpy
+  try:
+    duration, delay = audioTimes(filename)
+  except (OSError, subprocess.CalledProcessError, ValueError, KeyError, IndexError):
+    logger.log('Could not probe recording, decoding it serially', MYLOG.WARNING)
+    return None
+  segments = min(segments, int(duration / kSegment_Min))
+  if segments < 2:
+    return None
+  fps = params.rateNum / params.rateDen
+  frames = int(duration * fps)
+  check = int(math.ceil(kSegment_Check * fps))
+  bounds = [frames * i // segments for i in range(segments)] + [None]  # the last runs to the end
+  jobs = [(0, 0, bounds[1])]
+  for i in range(1, segments):
+    # seek to a whole 10ms so the first sample is exact
+    seek = math.floor((bounds[i] / fps - kSegment_Overlap) * 100) / 100
+    jobs.append((seek, bounds[i] - check, bounds[i + 1]))
+  logger.log('Decoding in %d segments' % segments, MYLOG.DEBUG)
+  with concurrent.futures.ThreadPoolExecutor(segments) as pool:
+    parts = list(pool.map(lambda job: decodeSegment(filename, audio, params, delay, *job), jobs))
+  # each segment starts with frames the previous one measured, which only match if they line up
+  levels = [parts[0]]
+  for i in range(1, segments):
+    seek, first, end = jobs[i - 1]
+    if (len(parts[i - 1]) != end - first or len(parts[i]) < check
+        or not numpy.array_equal(parts[i - 1][-check:], parts[i][:check])):
+      logger.log('Segment %d did not line up, decoding serially' % (i + 1), MYLOG.WARNING)
+      return None
+    levels.append(parts[i][check:])
+  return numpy.concatenate(levels)
+
+def profileSource(filename):
+  "Returns the (size, mtime) that identify the recording a profile is measured from"
+  info = os.stat(filename)
+  return info.st_size, int(info.st_mtime)
+
+def stampProfile(path, source):
+  "Records the recording a complete profile was measured from in its header"
+  with gzip.open(path, 'rb') as f:
+    data = f.read()
+  fields = kProfile_Header.unpack_from(data)[:-2] + source
+  with gzip.open(path, 'wb') as f:
+    f.write(kProfile_Header.pack(*fields))
+    f.write(memoryview(data)[kProfile_Header.size:])
+
+def profileMismatch(path, source, fps):
+  "Returns why a profile doesn't hold the levels this job would measure from the recording, or None if it does"
+  try:
+    with gzip.open(path, 'rb') as f:
+      magic, version, num, den, flags, channels, size, mtime = kProfile_Header.unpack(f.read(kProfile_Header.size))
+  except (IOError, OSError, EOFError, struct.error):
+    return 'it is unreadable'
+  if magic != b'SLNC' or version != kProfile_Version:
+    return 'it has an old or unknown format'
+  if flags & 1:
+    return 'it holds RMS levels'
+  if channels != int(kUpmix_Channels):
+    return 'it holds levels of %d channels' % channels
+  import silencedetect  # parses rates such as 59.94 as silence does
+  if den == 0 or fractions.Fraction(num, den) != fractions.Fraction(*silencedetect.parseRate(fps)):
+    return 'it is at %d/%d fps' % (num, den)
+  if (size, mtime) != source:
+    return 'it was measured from another version of the recording'
+  return None
+
+class INOTIFY:
+  "Watches a file for writes & close using Linux inotify"
+
+  IN_MODIFY = 0x2
+  IN_CLOSE_WRITE = 0x8
+  kEvent = struct.Struct('iIII')  # wd, mask, cookie, len
+
+  def __init__(self, filename):
+    "Start watching. Raises OSError if inotify is unavailable"
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+    if libc.inotify_add_watch(self.fd, os.fsencode(filename),
+                              self.IN_MODIFY | self.IN_CLOSE_WRITE) < 0:
+      errno = ctypes.get_errno()
+      os.close(self.fd)
+      raise OSError(errno, 'inotify_add_watch failed for ' + filename)
+
+  def wait(self, timeout):
+    "Waits for events. Returns their combined mask or 0 on timeout"
+    ready, _, _ = select.select([self.fd], [], [], timeout)
+    if not ready:
+      return 0
+    data = os.read(self.fd, 4096)
+    mask = 0
+    pos = 0
+    while pos < len(data):
+      wd, event, cookie, length = self.kEvent.unpack_from(data, pos)
+      mask |= event
+      pos += self.kEvent.size + length
+    return mask
+
+  def close(self):
+    "Stop watching"
+    os.close(self.fd)
+
+class FOLLOWER(threading.Thread):
+  "Streams a (possibly growing) recording into a pipe until the recording has finished"
+
+  def __init__(self, filename, sink, inProgress, logger, timeout = kIdle_Timeout, offset = 0, live = None):
+    "Initialise follower. inProgress() must return False once the recorder has stopped, live() is called on catching up with it"
+    threading.Thread.__init__(self, name='follower')
+    self.daemon = True
+    self.filename = filename
+    self.sink = sink
+    self.inProgress = inProgress
+    self.logger = logger
+    self.timeout = timeout
+    self.offset = offset  # bytes sent to the sink, counted from the start of the file
+    self.live = live
+    self.stopped = threading.Event()
+    self.failing = False  # the last backend check failed
+
+  def _recording(self, idle):
+    "Whether the recorder is still writing. If the backend can't be asked, the file must idle for the timeout"
+    try:
+      recording = self.inProgress()
+    except Exception as e:
+      if not self.failing:  # once, not every poll
+        self.logger.log('Failed to check recording, it ends after %gs without writes: %s' % (self.timeout, e),
+                        MYLOG.ERR)
+      self.failing = True
+      return idle < self.timeout
+    self.failing = False
+    return recording
+
+  def stop(self):
+    "Stop following, eg. when the job has failed"
+    self.stopped.set()
+
+  def _write(self, view):
+    "Write a buffer to the sink, handling partial writes"
+    fd = self.sink.fileno()
+    while view:
+      view = view[os.write(fd, view):]
+
+  def run(self):
+    "Copy file to sink in large chunks, waiting for more data whilst recording"
+    try:
+      events = INOTIFY(self.filename)
+    except OSError as e:
+      self.logger.log('Polling for end of recording: %s' % e, MYLOG.WARNING)
+      events = None
+    buf = bytearray(kChunk_Size)
+    view = memoryview(buf)
+    finished = False
+    check = True  # ask backend at the next EOF
+    idle = 0      # seconds without file activity
+    try:
+      with open(self.filename, 'rb', buffering=0) as infile:
+        infile.seek(self.offset)
+        while not self.stopped.is_set():
+          count = infile.readinto(buf)
+          if count:
+            self._write(view[:count])
+            self.offset += count
+            idle = 0
+          elif finished:
+            break  # recording stopped & file drained
+          elif (check or events is None or idle >= self.timeout) and not self._recording(idle):
+            finished = True  # read anything written since the last read, then stop
+          elif self.live:
+            # from now on the decoder only has to keep pace with the recorder
+            self.live()
+            self.live = None
+          elif events is None:
+            time.sleep(kPoll_Interval)
+            idle += kPoll_Interval
+          else:
+            # wait for the recorder to write or close the file
+            mask = events.wait(kPoll_Interval)
+            if mask & INOTIFY.IN_CLOSE_WRITE:
+              check = True  # keep asking until the backend agrees it has stopped
+            elif mask:
+              check = False
+              idle = 0
+            else:
+              if idle >= self.timeout:
+                idle = 0  # fallback check done, start another timeout
+              idle += kPoll_Interval
+    except BrokenPipeError:
+      self.logger.log('Decoder closed its input at byte %d' % self.offset, MYLOG.ERR)
+    except Exception as e:
+      self.logger.log('Following recording failed at byte %d: %s' % (self.offset, e), MYLOG.ERR)
+    finally:
+      self.sink.close()
+      if events:
+        events.close()
+    self.logger.log('Recording finished after %d bytes' % self.offset, MYLOG.DEBUG)
+
+
+class CHECKPOINT:
+  "Saves how far a job has got, so that a restarted job resumes rather than decoding from the start"
+
+  def __init__(self, filename, settings, logger):
+    "settings are the options a resumed job must share"
+    self.path = filename + kCheckpoint_Suffix
+    self.settings = settings
+    self.logger = logger
+    self.offsets = None
+
+  def load(self):
+    "Returns the saved checkpoint if it was made with the same settings, else None"
+    try:
+      with open(self.path) as f:
+        saved = json.load(f)
+      if saved['settings'] == self.settings:
+        int(saved['state'].split()[0])
+        return saved
+      self.logger.log('Ignoring checkpoint made with other settings', MYLOG.DEBUG)
+    except (IOError, OSError, ValueError, KeyError, IndexError):
+      pass
+    return None
+
+  def start(self, offset):
+    "Start checkpointing a job that reads the file from a byte offset"
+    self.offsets = collections.deque([offset] * kCheckpoint_Lag, kCheckpoint_Lag)
+
+  def save(self, state, position, cuts):
+    "Save the detector state reported once <position> bytes had been sent to the decoder"
+    # the decoder lags the bytes sent to it, so resume from where they had got a few reports ago
+    offset = self.offsets[0]
+    self.offsets.append(position)
+    part = self.path + '.part'
+    with open(part, 'w') as f:
+      json.dump({'settings': self.settings, 'offset': offset - offset % kTS_Packet,
+                 'state': state, 'cuts': cuts}, f)
+    os.replace(part, self.path)
+
+  def remove(self):
+    "Forget the checkpoint once the job has finished"
+    if os.path.exists(self.path):
+      os.unlink(self.path)
+
+
+class SCHEDULER:
+  "Limits the jobs decoding at once by core count & load average, starting watched recordings first"
+
+  def __init__(self, db, be, logger, workers = 0):
+    "A worker limit of 0 uses the core count"
+    self.db = db
+    self.be = be
+    self.logger = logger
+    self.cores = os.cpu_count() or 1
+    self.workers = workers or self.cores
+    self.running = 0
+    self.waiting = []  # [priority, arrival, rec] lists, lowest first
+    self.arrivals = 0
+    self.cond = threading.Condition()
+
+  def _priority(self, rec):
+    "0 for a watched recording, 1 for one still recording, 2 for a finished one"
+    try:
+      if recordingWatched(self.db, rec.chanid, rec.starttime):
+        return 0
+    except Exception as e:
+      self.logger.log('Failed to check players: %s' % e, MYLOG.DEBUG)
+    try:
+      return 1 if recordingInProgress(self.be, rec.chanid, rec.starttime) else 2
+    except Exception as e:
+      self.logger.log('Failed to check recorder: %s' % e, MYLOG.DEBUG)
+      return 1
+
+  def _admit(self):
+    "Whether another decoder may start"
+    if self.running == 0:
+      return True  # always make progress
+    return self.running < self.workers and os.getloadavg()[0] < self.cores
+
+  def acquire(self, rec):
+    "Waits until a decoder may be started for the recording"
+    entry = [self._priority(rec), self.arrivals, rec]
+    with self.cond:
+      self.arrivals += 1
+      self.waiting.append(entry)
+      while True:
+        self.waiting.sort(key=lambda e: e[:2])
+        if self.waiting[0] is entry and self._admit():
+          break
+        self.cond.wait(kSchedule_Interval)
+        # a player may have been started or the recording finished whilst waiting
+        self.cond.release()
+        try:
+          entry[0] = self._priority(rec)
+        finally:
+          self.cond.acquire()
+      self.waiting.remove(entry)
+      self.running += 1
+      self.cond.notify_all()
+      self.logger.log('Starting decoder %d of %d' % (self.running, self.workers), MYLOG.DEBUG)
+
+  def acquireMore(self, wanted):
+    "Takes up to <wanted> more decoders for a job that has one, if they are free now. Returns how many"
+    with self.cond:
+      taken = 0
+      # jobs waiting for their first decoder come first
+      while taken < wanted and not self.waiting and self.running < self.workers and os.getloadavg()[0] < self.cores:
+        self.running += 1
+        taken += 1
+      return taken
+
+  def release(self, count = 1):
+    "Signals that decoders have finished"
+    with self.cond:
+      self.running -= count
+      self.cond.notify_all()
+
+def makeParser():
+  "Returns the parser for job options"
+  parser = argparse.ArgumentParser(description='Commflagger')
+  parser.add_argument('--preset', help='Specify values as "Threshold, MinQuiet, MinDetect, MinLength, MaxSep, Pad, Preroll"')
+  parser.add_argument('--presetfile', help='Specify file containing preset values')
+  parser.add_argument('--chanid', type=int, help='Use chanid for manual operation')
+  parser.add_argument('--starttime', help='Use starttime for manual operation')
+  parser.add_argument('--file', help='Use filename for manual operation')
+  parser.add_argument('--flushcuts', type=int, default=10,
+                      help='Write cuts to the database after this many are pending (0 = at end only)')
+  parser.add_argument('--flushsecs', type=float, default=60,
+                      help='Write pending cuts to the database after this many seconds (0 = at end only)')
+  parser.add_argument('--timeout', type=float, default=kIdle_Timeout,
+                      help='Seconds without file activity before checking whether the recording has finished')
+  parser.add_argument('--native', action="store_true",
+                      help='Decode the recording in silence (built with LIBAV=1) instead of mythffmpeg')
+  parser.add_argument('--downmix', action="store_true",
+                      help='Decode the native channels instead of upmixing to %s. Levels are rescaled to match the upmix' % kUpmix_Channels)
+  parser.add_argument('--fps', help='Video frame rate, eg. 25 or 30000/1001 (default: from recording)')
+  parser.add_argument('--adaptive', type=float, default=0, metavar='DB',
+                      help='Adapt the threshold to this many dB above the noise floor, after a minute at the preset threshold')
+  parser.add_argument('--snap', action="store_true",
+                      help='Move cuts to keyframes when the job finishes, for instant seeks')
+  parser.add_argument('--engine', choices=['silence', 'python'], default='silence',
+                      help='Detect with the silence executable or in-process with NumPy (silencedetect.py)')
+  parser.add_argument('--binary', action="store_true",
+                      help='Read cuts from silence as binary records rather than parsing its log')
+  parser.add_argument('--daemon', action="store_true",
+                      help='Run jobs handed over by silencejob.py on warm database & backend connections')
+  parser.add_argument('--socket', default=kSocket_Path,
+                      help='Socket used by --daemon & silencejob.py (default: %s)' % kSocket_Path)
+  parser.add_argument('--dump', action="store_true", help='Generate stack trace of exception')
+  parser.add_argument('--segments', type=int, default=0,
+                      help='Decode finished recordings as this many segments in parallel & detect with NumPy')
+  parser.add_argument('--profile', action="store_true",
+                      help='Save the level of every frame next to the recording, for --cached')
+  parser.add_argument('--cached', action="store_true",
+                      help='Detect from the levels saved by --profile, if the recording has finished & has them')
+  parser.add_argument('--follow', action="store_true",
+                      help='Follow the file as if still recording, even if the recording has finished')
+  parser.add_argument('--workers', type=int, default=0,
+                      help='Most recordings to decode at once (default: number of cores)')
+  parser.add_argument('jobid', nargs='*', help='Myth job ids')
+  return parser
+
+def flag(args, db, be, scheduler):
+  "Commflag a recording, returning the exit status"
+  decoding = False
+  lock = threading.Lock()
+  def release():
+    "Frees our decoder, once, when it finishes or catches up with a recording"
+    nonlocal decoding
+    with lock:
+      if decoding:
+        decoding = False
+        scheduler.release()
+  batch = False
+  markup = None
+  pipes = []  # our ends of the record pipe, closed when the job ends
+  procs = []  # decoders, reaped when the job ends so a daemon doesn't collect zombies
+  follower = None
+  partial = None  # profile being written, removed unless the job completes it
   try:
-    # define options
-    parser = argparse.ArgumentParser(description='Commflagger')
-    parser.add_argument('--preset', help='Specify values as "Threshold, MinQuiet, MinDetect, MinLength, MaxSep, Pad, Preroll"')
-    parser.add_argument('--presetfile', help='Specify file containing preset values')
-    parser.add_argument('--chanid', type=int, help='Use chanid for manual operation')
-    parser.add_argument('--starttime', help='Use starttime for manual operation')
-    parser.add_argument('--file', help='Use filename for manual operation')
-    parser.add_argument('--dump', action="store_true", help='Generate stack trace of exception')
-    parser.add_argument('jobid', nargs='?', help='Myth job id')
-
-    # must set up log attributes before Db locks them
-    MYLOG.loadArgParse(parser)
-    MYLOG._setmask(MYLOG.COMMFLAG)
-
-    # parse options
-    args = parser.parse_args()
-
-    # connect to backend
-    db = MythTV.MythDB()
     logger = MYLOG(db)
-    be = MythTV.BECache(db=db)
 
     logger.log('')	# separate jobs in logfile
     if args.jobid:
@@ -189,55 +927,232 @@ def main():
 
     # Pipe file through ffmpeg to extract uncompressed audio stream. Keep going till recording is finished.
     infile = os.path.join(sg.dirname, rec.basename)
-    p1 = subprocess.Popen(["tail", "--follow", "--bytes=+1", infile], stdout=subprocess.PIPE)
-    p2 = subprocess.Popen(["mythffmpeg", "-loglevel", "quiet", "-i", "pipe:0",
-                "-f", "au", "-ac", kUpmix_Channels, "-"],
-                stdin=p1.stdout, stdout=subprocess.PIPE)
-    # Pipe audio stream to C++ silence which will spit out formatted log lines
-    p3 = subprocess.Popen([kExe_Silence, "%d" % p1.pid] + param.getValues(), stdin=p2.stdout,
-                stdout=subprocess.PIPE)
-
-    # Purge any existing skip list and flag as in-progress
+    # a finished recording is decoded straight from the file at full speed
+    batch = not args.follow and recordingFinished(be, rec)
+    if batch:
+      logger.log('Recording has finished, flagging in batch mode', MYLOG.DEBUG)
+    fps = args.fps or frameRate(infile, db, rec, logger)
+    logger.log('Frame rate is %s' % fps, MYLOG.DEBUG)
+    if (args.engine == 'python' or (batch and args.segments > 1)) and (args.native or args.binary):
+      logger.log('--native and --binary need the silence engine, and a finished recording needs them without --segments',
+                 MYLOG.ERR)
+      try:
+        job.update({'status': job.ERRORED, 'comment': 'Conflicting options'})
+      except AttributeError : pass
+      return 1
+    # wait for a free decoder
+    scheduler.acquire(rec)
+    decoding = True
+    logLevel = detectorLogLevel()
+    silence = [kExe_Silence, "-f", fps, "-v", str(logLevel)]
+    # a followed recording may run for hours: stream it, reporting progress
+    stream = 0 if batch else progressFrames(fps)
+    if stream:
+      silence += ["-s", str(stream)]
+    if args.adaptive:
+      silence += ["-A", str(args.adaptive)]
+    fds = ()
+    if args.binary:
+      # cuts arrive on their own pipe, stdout is only logged
+      recordFd, writeFd = os.pipe()
+      pipes += [recordFd, writeFd]
+      silence += ["-b", str(writeFd)]
+      fds = (writeFd,)
+    if args.downmix:
+      # keep the source channels & rate; silence rescales levels to the upmix's channel count, which
+      # matches the upmix exactly as its extra channels are silent. A lower rate would filter out noise
+      audio = []
+      scale = ["-c", kUpmix_Channels]
+    else:
+      audio = ["-ac", kUpmix_Channels]
+      scale = []
+    levels = None
+    profile = infile + kProfile_Suffix
+    partial = profile + '.part' if args.profile else None  # renamed once complete
+    cached = args.cached and batch and os.path.exists(profile)
+    if cached:
+      mismatch = profileMismatch(profile, profileSource(infile), fps)
+      if mismatch:
+        logger.log('Not using level profile %s as %s' % (profile, mismatch), MYLOG.INFO)
+        cached = False
+    if cached:
+      # re-run detection from the levels saved by an earlier job
+      import silencedetect
+      rate, rms, levels = silencedetect.readProfile(profile)
+      params = silencedetect.Params(param.getValues(), rate, rms=rms, logLevel=logLevel, adaptive=args.adaptive)
+      logger.log('Detecting from level profile %s' % profile, MYLOG.DEBUG)
+      partial = None
+    elif batch and args.segments > 1:
+      # decode parts of the file in parallel, then detect over the stitched levels
+      import silencedetect
+      params = silencedetect.Params(param.getValues(), fps, kUpmix_Channels if args.downmix else 0,
+                                    logLevel=logLevel, adaptive=args.adaptive)
+      # each segment is a decoder, so only use as many as the pool can spare
+      extra = scheduler.acquireMore(args.segments - 1)
+      try:
+        levels = segmentedLevels(infile, audio, params, extra + 1, logger)
+      finally:
+        scheduler.release(extra)
+      if levels is not None and partial:
+        writer = silencedetect.ProfileWriter(partial, params, params.refChannels or int(kUpmix_Channels))
+        writer.write(levels)
+        writer.close()
+    # resume an interrupted job from its checkpoint, decoding from a little before the frame it got to
+    checkpoint = None
+    resume = None
+    trim = []
+    sample = 0
+    offset = 0  # byte the recording is read from
+    if levels is None and not args.native:
+      checkpoint = CHECKPOINT(infile, [param.getValues(), fps, args.downmix, args.engine, args.adaptive], logger)
+      resume = checkpoint.load()
+    if resume:
+      try:
+        start, rate = audioStart(infile)
+      except (OSError, subprocess.CalledProcessError, ValueError, KeyError, IndexError):
+        logger.log('Could not probe recording, starting again', MYLOG.WARNING)
+        resume = None
+    if resume:
+      frame = int(resume['state'].split()[0])
+      # a whole 10ms so the first sample is exact at any output rate
+      seek = max(math.floor((frame / frameRateValue(fps) - kResume_Margin) * 100) / 100, 0)
+      # timestamps are kept so the decoder can trim to the same sample however far before it the input starts
+      trim = ["-copyts", "-af", "atrim=start=%.6f" % (start + seek)]
+      sample = int(round(seek * rate))
+      silence += ["-R", resume['state'], "-a", str(sample)]
+      partial = None  # a profile needs every frame
+      offset = resume['offset']
+      logger.log('Resuming from frame %d, byte %d' % (frame, resume['offset']), MYLOG.INFO)
+    if partial:
+      silence += ["-p", partial]
+    if levels is not None:
+      events = map(parseLine, itertools.chain(params.header(), silencedetect.detectLevels([levels], params)))
+    elif args.native:
+      # silence decodes the recording itself, with levels scaled as if upmixed
+      source = open(infile, 'rb') if batch else subprocess.PIPE
+      p3 = subprocess.Popen(silence + ["-n", "-c", kUpmix_Channels, "0"] + param.getValues(),
+                  stdin=source, stdout=subprocess.PIPE, pass_fds=fds)
+      procs.append(p3)
+      sink = p3.stdin
+      if batch:
+        source.close()
+    else:
+      if batch and resume:
+        # feed the rest of the file, the decoder doesn't need its start
+        source = open(infile, 'rb')
+        source.seek(offset)
+      else:
+        source = subprocess.DEVNULL if batch else subprocess.PIPE
+      p2 = subprocess.Popen(["mythffmpeg", "-loglevel", "quiet"] + trim[:1] +
+                  ["-i", infile if batch and not resume else "pipe:0"] + trim[1:] + ["-f", "au"] + audio + ["-"],
+                  stdin=source, stdout=subprocess.PIPE)
+      procs.append(p2)
+      if batch and resume:
+        source.close()
+      sink = p2.stdin
+      if args.engine == 'python':
+        # detect in this process, directly from ffmpeg's output
+        import silencedetect
+        events = map(parseLine, silencedetect.detect(p2.stdout, silencedetect.Params(
+                  param.getValues(), fps, kUpmix_Channels if args.downmix else 0, logLevel=logLevel,
+                  streamFrames=stream, adaptive=args.adaptive), profile=partial, state=resume and resume['state'], sample=sample))
+      else:
+        # Pipe audio stream to C++ silence which will spit out formatted log lines.
+        # There is no pipeline head for it to kill: the follower closes ffmpeg's input instead
+        p3 = subprocess.Popen(silence + scale + ["0"] + param.getValues(), stdin=p2.stdout,
+                    stdout=subprocess.PIPE, pass_fds=fds)
+        procs.append(p3)
+        p2.stdout.close()
+    if args.binary:
+      # silence has its own copy of the write end
+      os.close(writeFd)
+      pipes.remove(writeFd)
+      if levels is None:
+        LOGREADER(p3.stdout, logger).start()
+        events = readRecords(recordFd)
+    elif levels is None and args.engine == 'silence':
+      events = (parseLine(line.decode('utf-8')) for line in iter(p3.stdout.readline, b''))
+    if batch:
+      follower = None
+    else:
+      follower = FOLLOWER(infile, sink,
+                          lambda: recordingInProgress(be, rec.chanid, rec.starttime), logger,
+                          args.timeout, offset, release)
+      follower.start()
+    # the progress of a followed recording is checkpointed, binary records don't carry the state
+    saving = checkpoint is not None and follower is not None and not args.binary
+    if saving:
+      checkpoint.start(offset)
+
+    # Flag as in-progress. A batch keeps the existing skip list until the new one replaces it,
+    # a resumed job keeps the cuts it had made by its checkpoint
     rec.commflagged = 2
-    rec.markup.clean()
+    if not batch and not resume:
+      rec.markup.clean()
     rec.bookmarkupdate=datetime.datetime.now()
     rec.update()
+    if batch:
+      markup = MARKUPWRITER(db, rec, logger, 0, 0)
+    else:
+      markup = MARKUPWRITER(db, rec, logger, args.flushcuts, args.flushsecs)
+    if resume:
+      markup.replace([tuple(cut) for cut in resume['cuts']])
+    player = PLAYERUPDATE(be, rec, progId, logger)
 
-    # Process log output from C++ silence
-    breaks = 0
-    level = {'info': MYLOG.INFO, 'debug': MYLOG.DEBUG, 'err': MYLOG.ERR}
-    while True:
-      line = p3.stdout.readline().decode('utf-8')
-      if line:
-        flag, info = line.split('@', 1)
-        if flag == 'cut':
-          # extract numbers from log line
-          numbers = re.findall('\d+', info)
+    # Process output from the detector
+    breaks = len(markup.cuts)
+    progress = 0  # frames the detector has processed, reported by a stream
+    for flag, info, cut in events:
+      if cut:
+        if info:
           logger.log(info)
-          # mark advert in database
-          rec.markup.append(int(numbers[0]), rec.markup.MARK_COMM_START, None)
-          rec.markup.append(int(numbers[1]), rec.markup.MARK_COMM_END, None)
-          rec.update()
-          breaks += 1
-          # send new advert skiplist to MythPlayers
-          skiplist = ['%d:%d,%d:%d'%(x, rec.markup.MARK_COMM_START, y, rec.markup.MARK_COMM_END)
-                   for x, y in rec.markup.getskiplist()]
-          mesg = 'COMMFLAG_UPDATE %s %s'%(progId, ','.join(skiplist))
-#         logger.log('  Sending %s'%mesg,  MYLOG.DEBUG)
-          result = be.backendCommand("MESSAGE[]:[]" + mesg)
-          if result != 'OK':
-            logger.log('Sending update message to backend failed, response = %s, message = %s'% (result, mesg), MYLOG.ERR)
-        elif flag in level:
-          logger.log(info, level.get(flag))
-        else:  # unexpected prefix
-          # use warning for unexpected log levels
-          logger.log(flag, MYLOG.WARNING)
-      else:
-        break
+        # queue advert for the database
+        start, end = cut
+        markup.append(start, end)
+        breaks += 1
+        # send new advert skiplist to MythPlayers
+        if not batch:
+          player.send(markup.cuts)
+      elif flag == 'progress':
+        progress = int(info.split()[0])
+        if not args.binary:  # else logged by LOGREADER
+          logger.log('Detected up to frame %d' % progress, MYLOG.DEBUG)
+        if saving:
+          checkpoint.save(info, follower.offset, markup.cuts)
+      elif flag in kLevel:
+        logger.log(info, kLevel.get(flag))
+      else:  # unexpected prefix
+        # use warning for unexpected log levels
+        logger.log(flag, MYLOG.WARNING)
+      markup.poll()
+    if follower:
+      follower.join()
+    for p in procs:
+      p.wait()
+    release()
+    if partial and os.path.exists(partial):
+      # the recording has finished, so it is identified as it will be read by --cached
+      stampProfile(partial, profileSource(infile))
+      os.rename(partial, profile)
+      logger.log('Saved level profile %s' % profile, MYLOG.DEBUG)
 
-    # Signal comflagging has finished
+    # Write remaining cuts & signal comflagging has finished
+    cuts = markup.cuts
+    if args.snap:
+      cuts = KEYFRAMES(db, rec).snapAll(markup.cuts)
+      if cuts != markup.cuts:
+        logger.log('Snapped cuts to keyframes', MYLOG.DEBUG)
+    snapped = cuts != markup.cuts
+    if batch or snapped:
+      markup.replace(cuts)
+    else:
+      markup.flush()
+    if snapped or batch:
+      player.send(markup.cuts)
     rec.commflagged = 1
     rec.update()
+    if checkpoint:
+      checkpoint.remove()
 
     logger.log('Detected %s adverts.' % breaks)
     try:
@@ -246,8 +1161,8 @@ def main():
 
     # Finishing too quickly can cause writeStringList/socket errors in the BE. (pre-0.28 only?)
     # A short delay prevents this
-    import time
     time.sleep(1)
+    return 0
 
   except Exception as e:
     # get exception before we generate another
@@ -261,6 +1176,11 @@ def main():
     try:
       logger.log(status, MYLOG.ERR)
     except : pass
+    # keep the cuts found so far; a batch keeps the previous skip list instead
+    try:
+      if markup and not batch:
+        markup.flush()
+    except : pass
     try:
       job.update({'status': job.ERRORED, 'comment': 'Failed.'})
     except : pass
@@ -291,7 +1211,115 @@ def main():
           frame = frame.tb_next
         logger.log('\n'.join(stack), MYLOG.ERR)
     except : pass
-    sys.exit(1)
+    return 1
+  finally:
+    release()
+    for fd in pipes:
+      os.close(fd)
+    # a failed job leaves its pipeline blocked, kill it
+    for p in procs:
+      if p.poll() is None:
+        p.kill()
+      p.wait()
+    if follower:
+      follower.stop()
+      follower.join()
+    if partial and os.path.exists(partial):
+      try:
+        os.unlink(partial)
+      except OSError:
+        pass
+
+def flagAll(args, db, be, scheduler):
+  "Commflag each job concurrently, returning the worst exit status"
+  def run(jobid):
+    "Runs one job on a copy of the options"
+    jobargs = argparse.Namespace(**vars(args))
+    jobargs.jobid = jobid
+    try:
+      return flag(jobargs, db, be, scheduler)
+    except SystemExit as e:
+      return e.code if isinstance(e.code, int) else 1
+  jobids = args.jobid or [None]
+  if len(jobids) == 1:
+    return run(jobids[0])
+  status = {}
+  threads = [threading.Thread(target=lambda j=j: status.update({j: run(j)}), name='job %s' % j)
+             for j in jobids]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  return max(status.values())
+
+class JOBHANDLER(socketserver.StreamRequestHandler):
+  "Runs a job handed over by silencejob.py & replies with its exit status"
+
+  def handle(self):
+    request = json.loads(self.rfile.readline().decode('utf-8'))
+    status = self.server.run(request['argv'])
+    self.wfile.write((json.dumps({'status': status}) + '\n').encode('utf-8'))
+
+class SERVER(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  "Runs jobs in threads, sharing database & backend connections and parsed presets"
+
+  daemon_threads = True
+
+  def __init__(self, path, db, be, workers):
+    "Listen on a socket only our user can use"
+    self.db = db
+    self.be = be
+    self.logger = MYLOG(db)
+    # one decoder pool for all clients
+    self.scheduler = SCHEDULER(db, be, self.logger, workers)
+    self.parser = makeParser()
+    if os.path.lexists(path):
+      # only replace our own socket, left by a daemon that is no longer listening
+      info = os.lstat(path)
+      if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise OSError('%s exists and is not our socket' % path)
+      probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      try:
+        probe.connect(path)
+        raise OSError('A daemon is already listening on %s' % path)
+      except ConnectionRefusedError:
+        os.unlink(path)
+      finally:
+        probe.close()
+    mask = os.umask(0o177)
+    try:
+      socketserver.UnixStreamServer.__init__(self, path, JOBHANDLER)
+    finally:
+      os.umask(mask)
+    self.logger.log('Waiting for jobs on %s' % path)
+
+  def run(self, argv):
+    "Runs a job from its command line, returning its exit status"
+    # logging is set up by the daemon's command line so ignore any log options
+    args, ignored = self.parser.parse_known_args(argv)
+    if ignored:
+      self.logger.log('Ignoring job options %s' % ' '.join(ignored), MYLOG.DEBUG)
+    return flagAll(args, self.db, self.be, self.scheduler)
+
+def main():
+  "Commflag a recording or serve jobs"
+  parser = makeParser()
+
+  # must set up log attributes before Db locks them
+  MYLOG.loadArgParse(parser)
+  MYLOG._setmask(MYLOG.COMMFLAG)
+
+  # parse options
+  args = parser.parse_args()
+
+  # connect to backend. MythBE adds recorder queries to BECache's messages
+  db = MythTV.MythDB()
+  be = MythTV.MythBE(db=db)
+
+  if args.daemon:
+    SERVER(os.path.expanduser(args.socket), db, be, args.workers).serve_forever()
+  else:
+    sys.exit(flagAll(args, db, be, SCHEDULER(db, be, MYLOG(db), args.workers)))
 
 if __name__ == '__main__':
   main()
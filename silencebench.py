@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# Benchmarks silence detectors on synthetic recordings with a known advert structure.
+# Generates programme/advert audio (AU or WAV), runs each detector over it & reports
+# speed, peak memory and how well the cuts match the adverts. Doesn't need MythTV.
+# v1.0 Initial version
+# Requires numpy
+
+import argparse
+import math
+import os
+import re
+import shlex
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy
+
+kDir = os.path.dirname(os.path.abspath(__file__))
+# the values silence.py has commented out. Its defaults (-88, 0.04, 3, 120, 120, 1, 0) count the
+# programme's short pauses as silences, so they flag almost all of this audio as adverts
+kPreset = ['-75', '0.16', '6', '120', '120', '0.48', '0']
+kLoud = 0.1       # programme/advert noise amplitude (-20dB)
+kQuiet = 0.00003  # silence amplitude (-90dB), 0 for digital silence
+kGap = (0.3, 0.6) # seconds of silence between adverts
+
+def structure(seconds, rng, programme, breakLength, advert):
+  "Returns the silences [(start, end)] & advert breaks [(start, end)] of a recording, in seconds"
+  silences = []
+  breaks = []
+  t = programme
+  while t + breakLength + programme / 2 < seconds:
+    # a break is a run of adverts with a short silence before, between & after them
+    first = len(silences)
+    for i in range(int(breakLength // advert) + 1):
+      gap = rng.uniform(*kGap)
+      silences.append((t, t + gap))
+      t += gap + advert
+    t -= advert
+    breaks.append((silences[first][1], silences[-1][0]))  # the adverts
+    t += programme
+  return silences, breaks
+
+def pauses(seconds, rng, count):
+  "Returns short pauses in the programme, too short to count as silences"
+  return [(s, s + rng.uniform(0.02, 0.1)) for s in rng.uniform(0, seconds, count)]
+
+def generate(path, seconds, rate, channels, wav, seed, programme, breakLength, advert):
+  "Writes a synthetic recording, returning its advert breaks in seconds"
+  rng = numpy.random.default_rng(seed)
+  silences, breaks = structure(seconds, rng, programme, breakLength, advert)
+  quiet = pauses(seconds, rng, int(seconds // 10)) + silences
+  samples = int(seconds * rate)
+  with open(path, 'wb') as out:
+    if wav:
+      size = samples * channels * 2
+      out.write(struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + size, b'WAVE', b'fmt ', 16, 1, channels,
+                            rate, rate * channels * 2, channels * 2, 16, b'data', size))
+      dtype = '<i2'
+    else:
+      out.write(struct.pack('>4sIIIII', b'.snd', 24, 0xffffffff, 3, rate, channels))
+      dtype = '>i2'
+    # a second at a time keeps memory constant
+    for second in range(int(math.ceil(seconds))):
+      first = second * rate
+      count = min(rate, samples - first)
+      amplitude = numpy.full(count, kLoud)
+      for start, end in quiet:
+        if start < second + 1 and end > second:
+          amplitude[max(int(start * rate) - first, 0):max(int(end * rate) - first, 0)] = kQuiet
+      block = rng.standard_normal((count, channels)) * amplitude[:, None] * 32767
+      out.write(numpy.clip(block, -32768, 32767).astype(dtype).tobytes())
+  return breaks
+
+def command(engine, silence):
+  "Returns the command line of a named or given detector"
+  if engine == 'silence':
+    return [silence]
+  if engine == 'python':
+    return [sys.executable, os.path.join(kDir, 'silencedetect.py')]
+  return shlex.split(engine)
+
+class PEAKRSS(threading.Thread):
+  "Samples the peak resident memory of a process until it exits"
+
+  def __init__(self, pid):
+    threading.Thread.__init__(self, name='peakrss')
+    self.daemon = True
+    self.pid = pid
+    self.peak = 0  # KB
+    self.done = threading.Event()
+
+  def run(self):
+    # rusage would include the memory of this process, which forked the detector
+    while not self.done.wait(0.01):
+      try:
+        with open('/proc/%d/status' % self.pid) as status:
+          for line in status:
+            if line.startswith('VmHWM:'):
+              self.peak = max(self.peak, int(line.split()[1]))
+      except (IOError, OSError):
+        break
+
+def run(cmd, path, fps, level):
+  "Runs a detector over a file, returning (seconds, peak RSS in KB, cuts)"
+  cuts = []
+  start = time.time()
+  with open(path, 'rb') as audio:
+    p = subprocess.Popen(cmd + ['-f', fps, '-v', str(level), '0'] + kPreset,
+                         stdin=audio, stdout=subprocess.PIPE)
+    rss = PEAKRSS(p.pid)
+    rss.start()
+    for line in p.stdout:
+      line = line.decode('utf-8')
+      if line.startswith('cut@'):
+        numbers = re.findall(r'\d+', line.split('@', 1)[1])
+        cuts.append((int(numbers[0]), int(numbers[1])))
+      elif line.startswith('err@'):
+        sys.stderr.write(line)
+    p.wait()
+  elapsed = time.time() - start
+  rss.done.set()
+  rss.join()
+  return elapsed, rss.peak, cuts
+
+def score(cuts, breaks, fps, frames):
+  "Returns (breaks found, missed seconds, extra seconds) of cuts against the true breaks"
+  truth = numpy.zeros(frames + 2, bool)
+  for start, end in breaks:
+    truth[int(start * fps) + 1:int(end * fps) + 1] = True
+  found = numpy.zeros(frames + 2, bool)
+  for start, end in cuts:
+    found[start:end + 1] = True
+  hits = sum(1 for start, end in breaks if found[int((start + end) / 2 * fps)])
+  return hits, numpy.count_nonzero(truth & ~found) / fps, numpy.count_nonzero(found & ~truth) / fps
+
+def main():
+  "Benchmark detectors"
+  parser = argparse.ArgumentParser(description='Benchmarks silence detectors on synthetic recordings')
+  parser.add_argument('--minutes', type=float, default=60, help='Length of the recording (default: 60)')
+  parser.add_argument('--rate', type=int, default=48000, help='Sample rate (default: 48000)')
+  parser.add_argument('--channels', type=int, default=6, help='Channels (default: 6, as silence.py upmixes)')
+  parser.add_argument('--wav', action="store_true", help='Generate WAV rather than AU (silence only)')
+  parser.add_argument('--fps', default='25', help='Video frame rate (default: 25)')
+  parser.add_argument('--programme', type=float, default=600, help='Seconds of programme between breaks')
+  parser.add_argument('--breaklength', type=float, default=180, help='Seconds of adverts in a break')
+  parser.add_argument('--advert', type=float, default=30, help='Seconds of each advert')
+  parser.add_argument('--seed', type=int, default=1, help='Random seed, the same seed gives the same recording')
+  parser.add_argument('--engine', action='append',
+                      help='silence, python or a command taking silence arguments (default: silence & python)')
+  parser.add_argument('--silence', default=os.path.join(kDir, 'silence'), help='silence executable')
+  parser.add_argument('--level', type=int, default=1, help='Detector log level (default: 1)')
+  parser.add_argument('--repeat', type=int, default=3, help='Runs per engine, the fastest is reported')
+  parser.add_argument('--keep', help='Write the recording here & keep it')
+  args = parser.parse_args()
+
+  seconds = args.minutes * 60
+  num, den = (args.fps.split('/') + ['1'])[:2]
+  fps = float(num) / float(den)
+  frames = int(seconds * fps)
+  path = args.keep or tempfile.mkstemp(suffix='.wav' if args.wav else '.au')[1]
+  try:
+    print('Generating %g minutes of %d Hz %d channel %s' % (args.minutes, args.rate, args.channels,
+                                                            'WAV' if args.wav else 'AU'))
+    breaks = generate(path, seconds, args.rate, args.channels, args.wav, args.seed,
+                      args.programme, args.breaklength, args.advert)
+    size = os.path.getsize(path) / 1e6
+    print('%-10s %10s %8s %10s %7s %8s %8s' % ('engine', 'frames/s', 'MB/s', 'peak RSS', 'breaks',
+                                               'missed', 'extra'))
+    failed = False
+    for engine in args.engine or ['silence', 'python']:
+      if args.wav and engine == 'python':
+        continue  # silencedetect.py only reads AU
+      cmd = command(engine, args.silence)
+      best = None
+      for i in range(args.repeat):
+        elapsed, rss, cuts = run(cmd, path, args.fps, args.level)
+        best = min(best or elapsed, elapsed)
+      hits, missed, extra = score(cuts, breaks, fps, frames)
+      failed |= hits != len(breaks)
+      print('%-10s %10.0f %8.1f %7.1f MB %3d/%-3d %7.1fs %7.1fs' % (
+        os.path.basename(cmd[-1]) if engine not in ('silence', 'python') else engine,
+        frames / best, size / best, rss / 1024.0, hits, len(breaks), missed, extra))
+  finally:
+    if not args.keep:
+      os.unlink(path)
+  sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+  main()
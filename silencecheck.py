@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Checks that silencedetect.py gives exactly the same output as silence on synthetic recordings.
+# Generates AU files with silencebench.py, runs both detectors over them for several presets,
+# frame rates & options, and reports any output that differs. Doesn't need MythTV.
+# v1.0 Initial version
+# Requires numpy
+
+import argparse
+import difflib
+import os
+import subprocess
+import sys
+import tempfile
+
+import silencebench
+
+kDir = os.path.dirname(os.path.abspath(__file__))
+kPresets = [
+  ['-88', '0.04', '3', '120', '120', '1', '0'],    # silence.py defaults
+  ['-75', '0.16', '6', '120', '120', '0.48', '0'],
+  ['-80', '0.08', '2', '60', '90', '0', '0'],
+  ['-70', '0.32', '4', '90', '60', '0.48', '5']]
+kRates = ['25', '30000/1001', '59.94']
+kOptions = [[], ['-r'], ['-s', '1500'], ['-A', '20']]
+kRecordings = [  # seconds, sample rate, channels, seed
+  (1800, 8000, 2, 1),
+  (600, 48000, 6, 2)]
+
+def output(cmd, path):
+  "Returns a detector's output lines, without the line naming its energy kernels"
+  with open(path, 'rb') as audio:
+    lines = subprocess.run(cmd, stdin=audio, stdout=subprocess.PIPE, check=False).stdout
+  return [line for line in lines.decode('utf-8').splitlines() if 'energy kernels' not in line]
+
+def main():
+  "Compare detectors"
+  parser = argparse.ArgumentParser(description='Checks silencedetect.py against silence')
+  parser.add_argument('--silence', default=os.path.join(kDir, 'silence'), help='silence executable')
+  args = parser.parse_args()
+
+  python = [sys.executable, os.path.join(kDir, 'silencedetect.py')]
+  failed = 0
+  runs = 0
+  path = tempfile.mkstemp(suffix='.au')[1]
+  try:
+    for seconds, rate, channels, seed in kRecordings:
+      silencebench.generate(path, seconds, rate, channels, False, seed, 300, 120, 30)
+      for fps in kRates:
+        for preset in kPresets:
+          for options in kOptions:
+            detector = ['-f', fps, '-v', '2'] + options + ['0'] + preset
+            want = output([args.silence] + detector, path)
+            got = output(python + detector, path)
+            runs += 1
+            if want != got:
+              failed += 1
+              print('DIFFERENT: %d Hz %d ch, %s' % (rate, channels, ' '.join(detector)))
+              sys.stdout.writelines(line + '\n' for line in
+                                    list(difflib.unified_diff(want, got, 'silence', 'silencedetect.py', lineterm=''))[:20])
+  finally:
+    os.unlink(path)
+  print('%d of %d runs differ' % (failed, runs))
+  sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+# Python/NumPy version of the silence detector (silence.cpp).
+# Reproduces the Silence/Cluster state machine of silence.cpp exactly, so it produces
+# identical cut lists & log lines, but measures levels over large blocks of audio at a time.
+# v1.0 Initial version, matches silence v5.2
+# v1.1 Only format log lines that are wanted, matches silence v5.5
+# v1.2 Measure from any frame/sample so segments can be decoded in parallel & stitched
+# v1.3 Save & detect from level profiles (-p, -i), matches silence v5.6
+# v1.4 64-bit frame numbers & stream progress lines (-s), matches silence v5.8
+# v1.5 Resume from the state in a progress line (-R, -a), matches silence v5.9
+# v1.6 Optional adaptive threshold (-A), matches silence v6.0
+# v1.7 Profiles record the channels levels are averaged over & the source's identity, matches silence v6.1
+# Requires numpy
+
+import getopt
+import gzip
+import math
+import struct
+import sys
+
+import numpy
+
+kInt_Max = 2147483647
+kFrame_Mask = 0xFFFFFFFFFFFFFFFF  # frame numbers are 64-bit unsigned in silence.cpp
+kBlock_Frames = 250       # video frames of audio read at a time
+kProfile_Header = struct.Struct('<4sIIIIIQq')  # must correlate with silence.cpp Profile::header_t
+kProfile_Header_V1 = struct.Struct('<4sIIII')   # profiles saved before v1.7
+kProfile_Magic = b'SLNC'
+kProfile_None = 65535     # profile value of a frame with no signal
+
+# Output to silence.py requires prefix to indicate level
+kDelimiter = '@'  # must correlate with python wrapper
+prefixdebug = 'debug' + kDelimiter
+prefixinfo = 'info' + kDelimiter
+prefixerr = 'err' + kDelimiter
+prefixcut = 'cut' + kDelimiter
+prefixprogress = 'progress' + kDelimiter
+
+class DetectError(Exception):
+  "Invalid arguments or input"
+
+
+def f32(x):
+  "Rounds a value to single precision, as silence.cpp holds its arguments as floats"
+  return numpy.float32(x)
+
+def signed64(x):
+  "Value of an unsigned 64-bit frame number when printed with %lld"
+  x &= kFrame_Mask
+  return x - (1 << 64) if x & (1 << 63) else x
+
+
+class Params:
+  "Detection parameters, converted to frames exactly as silence.cpp does"
+
+  def __init__(self, values, rate = '25/1', channels = 0, rms = False, logLevel = 2, streamFrames = 0,
+               adaptive = 0):
+    "values are threshold, minquiet, mindetect, minlength, maxsep, pad, preroll"
+    if len(values) != 7:
+      raise DetectError('Expected 7 parameters, got %d' % len(values))
+    try:
+      threshold, minquiet, mindetect, minlength, maxsep, pad = [f32(float(v)) for v in values[:6]]
+      preroll = int(float(values[6]))
+    except ValueError:
+      raise DetectError('Could not parse parameters into numbers')
+    self.args = (threshold, minquiet, mindetect, minlength, maxsep, pad)
+    self.rateNum, self.rateDen = parseRate(rate)
+    self.refChannels = int(channels)
+    self.useRms = rms
+    self.logLevel = int(logLevel)  # 0 = errors, cuts & progress, 1 = info, 2 = debug
+    try:
+      self.streamFrames = int(streamFrames)  # frames between progress lines (0 = not streaming)
+    except ValueError:
+      self.streamFrames = -1
+    if self.streamFrames < 0:
+      raise DetectError('Could not parse stream option into a positive number')
+    try:
+      self.adaptMargin = f32(float(adaptive))  # dB above the noise floor (0 = fixed threshold)
+    except ValueError:
+      self.adaptMargin = f32(-1)
+    if self.adaptMargin < 0 or (adaptive and self.adaptMargin == 0):
+      raise DetectError('Could not parse adaptive margin option into a positive number')
+
+    self.videoRate = f32(self.rateNum / self.rateDen)
+    self.rateInMins = int(round(float(self.videoRate * f32(60))))
+    self.rateRound = int(math.ceil(float(self.videoRate / f32(2))))
+
+    # Scale threshold to integer range that libsndfile will use
+    self.useThreshold = int(round(kInt_Max * math.pow(10, float(threshold / f32(20)))))
+    # Scale times to frames
+    self.useMinQuiet = int(math.ceil(float(minquiet * self.videoRate)))
+    self.useMinDetect = int(mindetect)
+    self.useMinLength = int(math.ceil(float(minlength * self.videoRate)))
+    self.useMaxSep = int(round(float(maxsep * self.videoRate) + 0.5))
+    self.usePad = int(round(float(pad * self.videoRate) + 0.5))
+    self.onlyCutPreroll = preroll != 0
+
+  def frameStart(self, rate, frame):
+    "Audio sample (per channel) at which a frame starts, counting frames from 0"
+    return frame * rate * self.rateDen // self.rateNum
+
+  def logging(self, prefix):
+    "Whether lines with this prefix are wanted"
+    if prefix == prefixdebug:
+      return self.logLevel >= 2
+    if prefix == prefixinfo:
+      return self.logLevel >= 1
+    return True
+
+  def header(self):
+    "Returns the log lines silence prints before detection starts"
+    threshold, minquiet, mindetect, minlength, maxsep, pad = [float(a) for a in self.args]
+    lines = [
+      '%sThreshold=%.1f, MinQuiet=%.2f, MinDetect=%.1f, MinLength=%.1f, MaxSep=%.1f, Pad=%.2f' % (
+        prefixdebug, threshold, minquiet, mindetect, minlength, maxsep, pad),
+      '%sFrame rate is %.2f (%u/%u), Detecting silences below %d that last for at least %d frames' % (
+        prefixdebug, self.videoRate, self.rateNum, self.rateDen, self.useThreshold, self.useMinQuiet),
+      '%sClusters are composed of a minimum of %d silences closer than %d frames and must be' % (
+        prefixdebug, self.useMinDetect, self.useMaxSep),
+      '%slonger than %d frames in total. Cuts will be padded by %d frames.' % (
+        prefixdebug, self.useMinLength, self.usePad),
+      '%s%s' % (prefixdebug, 'Only preroll will be cut.' if self.onlyCutPreroll
+                             else 'All detected adverts will be cut.'),
+      '%sThreshold adapts to %.1fdB above the noise floor after %d frames.' % (
+        prefixdebug, self.adaptMargin, self.rateInMins) if self.adaptMargin else None,
+      '%s< preroll, > postroll, - advert, ? too few silences, # too short, = comm flagged' % prefixdebug,
+      '%s           Start - End    Start - End      Duration         Interval    Level/Count' % prefixinfo,
+      '%s          frame - frame (mmm:ss-mmm:ss) frame (mm:ss.s)  frame (mmm:ss)' % prefixinfo]
+    return [line for line in lines if line and self.logging(line[:line.index(kDelimiter) + 1])]
+
+def parseRate(arg):
+  "Parses a frame rate given as a fraction or decimal number into (num, den)"
+  try:
+    if '/' in arg:
+      num, den = [int(i) for i in arg.split('/', 1)]
+      if num <= 0 or den <= 0:
+        raise DetectError('Frame rate must be positive')
+      return num, den
+    rate = float(arg)
+  except ValueError:
+    raise DetectError('Could not parse frame rate option into a number')
+  if rate <= 0:
+    raise DetectError('Could not parse frame rate option into a number')
+  # decimal NTSC rates such as 29.97 or 59.94 mean n*1000/1001
+  whole = round(rate * 1.001)
+  if abs(rate - whole / 1.001) < 0.005 and abs(rate - whole) > 0.005:
+    return int(whole * 1000), 1001
+  return int(round(rate * 1000)), 1000
+
+
+class Silence:
+  "Defines a silence"
+
+  progStart, detection, progEnd = range(3)
+  state_log = '< >'
+
+  def __init__(self, start, power = 0.0, state = detection):
+    self.state = state
+    self.start = start
+    self.end = start
+    self.length = 1
+    self.interval = 0
+    self.power = float(power)
+
+  @classmethod
+  def span(cls, start, end, power):
+    "A silence from start to end with a given average power"
+    silence = cls(start, power)
+    silence.end = end
+    silence.length = end - start + 1
+    return silence
+
+  def extend(self, frame, power):
+    "Define end of the silence"
+    self.end = frame
+    self.length = frame - self.start + 1
+    # maintain running average power
+    self.power += (power - self.power) / self.length
+
+class Cluster:
+  "A cluster of silences"
+
+  # tooshort..unset are transient states - they may be updated, preroll..postroll are final
+  tooshort, toofew, unset, preroll, advert, postroll = range(6)
+  state_log = '#?.<->'
+
+  def __init__(self, silence, params):
+    self.params = params
+    self.state = self.unset
+    self.start = silence
+    self.end = silence
+    self.silenceCount = 1
+    self.length = silence.length
+    self.interval = 0
+    self.completesAt = silence.end + params.useMaxSep
+    self._setState()
+    # pad everything except pre-rolls
+    self.padStart = 1 if self.state == self.preroll else silence.start + params.usePad
+    self.padEnd = (silence.end - params.usePad) & kFrame_Mask
+
+  def _setState(self):
+    if self.start.start == 1:
+      self.state = self.preroll
+    elif self.end.state == Silence.progEnd:
+      self.state = self.postroll
+    elif self.length < self.params.useMinLength:
+      self.state = self.tooshort
+    elif self.silenceCount < self.params.useMinDetect:
+      self.state = self.toofew
+    else:
+      self.state = self.advert
+
+  def extend(self, silence):
+    "Define end of a cluster"
+    self.end = silence
+    self.silenceCount += 1
+    self.length = silence.end - self.start.start + 1
+    self.completesAt = silence.end + self.params.useMaxSep
+    self._setState()
+    # pad everything except post-rolls
+    self.padEnd = (silence.end - (0 if self.state == self.postroll else self.params.usePad)) & kFrame_Mask
+
+  def resume(self, silence, count):
+    "Restore a cluster of <count> silences, the last being silence"
+    if count > 1:
+      self.extend(silence)
+      self.silenceCount = count
+      self._setState()
+      self.padEnd = (silence.end - (0 if self.state == self.postroll else self.params.usePad)) & kFrame_Mask
+
+
+class Adaptive:
+  "Threshold that follows the programme's noise floor, counting levels in a histogram as silence -A does"
+
+  kPerDb = 4              # bins per dB
+  kBins = 120 * kPerDb    # 0 to -120dB, quieter levels share the last bin
+  kHeadroom = 20 * kPerDb # the threshold stays this far below the median
+  kFloor = 1000           # 1 in this many frames are below the noise floor
+  kUpdate = 16            # frames between threshold updates
+  kDecay = 32768          # frames between halving the counts
+
+  def __init__(self, params):
+    self.margin = int(round(float(params.adaptMargin) * self.kPerDb))
+    self.warmup = params.rateInMins  # a minute at the preset threshold
+    self.edges = [int(round(kInt_Max * math.pow(10.0, -b / (20 * self.kPerDb)))) for b in range(self.kBins)]
+    self.quiet = numpy.array(self.edges[:0:-1], numpy.float64)  # all but the loudest, ascending
+    self.count = numpy.zeros(self.kBins, numpy.int64)
+    self.total = 0  # levels counted
+    self.seen = 0   # frames added, for the warmup
+
+  def add(self, levels):
+    "Count the levels of frames up to the next update, returning the new threshold or None"
+    # levels no louder than an edge belong to its bin or a quieter one
+    bins = len(self.quiet) - numpy.searchsorted(self.quiet, levels, 'left')
+    self.count += numpy.bincount(bins, minlength=self.kBins)
+    self.total += len(levels)
+    self.seen += len(levels)
+    if self.seen % self.kUpdate:
+      return None
+    if self.seen % self.kDecay == 0:
+      self.count //= 2
+      self.total = int(self.count.sum())
+    if self.seen < self.warmup:
+      return None
+    # walk from the quiet end to the floor & then the median
+    below = numpy.cumsum(self.count[::-1])
+    over = numpy.flatnonzero(below > self.total // self.kFloor)
+    floor = self.kBins - 1 - int(over[0]) if len(over) else -1
+    over = numpy.flatnonzero(below > self.total // 2)
+    median = self.kBins - 1 - int(over[0]) if len(over) else 0
+    return self.edges[min(max(max(floor - self.margin, median + self.kHeadroom), 1), self.kBins - 1)]
+
+
+class Detector:
+  "Allocates silences to clusters from per-frame audio levels, as silence.cpp does"
+
+  def __init__(self, params, output):
+    "output is called with each log line"
+    self.params = params
+    self.output = output
+    self.frames = 0               # number of frames processed
+    self.currentSilence = None    # the silence currently being detected/built
+    self.currentCluster = None    # the cluster currently being built
+    self.lastSilence = None       # most recent recorded silence
+    self.lastCluster = None       # most recent completed cluster
+    self.threshold = params.useThreshold
+    self.adaptive = Adaptive(params) if params.adaptMargin else None
+
+  def state(self):
+    "Returns the frame count & what detection needs to resume, as silence prints them with its progress"
+    silence, cluster = self.currentSilence, self.currentCluster
+    return '%d %d %d %d %d %d %d %d %.17g %d %d %d %d %d %d' % ((self.frames,
+      self.lastSilence is not None, self.lastSilence.end if self.lastSilence else 0,
+      self.lastCluster is not None, self.lastCluster.end.end if self.lastCluster else 0) +
+      ((1, silence.start, silence.end, silence.power) if silence else (0, 0, 0, 0)) +
+      ((1, cluster.start.start, cluster.start.end, cluster.end.start, cluster.end.end, cluster.silenceCount)
+       if cluster else (0, 0, 0, 0, 0, 0)))
+
+  def restore(self, state):
+    "Resumes from a frame count followed by the state silence prints with its progress"
+    try:
+      fields = state.split()
+      (self.frames, silences, lastEnd, completed, clusterEnd, silenceOpen, start, end) = [
+        int(f) for f in fields[:8]]
+      power = float(fields[8])
+      (clusterOpen, firstStart, firstEnd, lastStart, lastStop, count) = [int(f) for f in fields[9:]]
+    except ValueError:
+      raise DetectError('Could not parse resume state')
+    # only the ends of the last silence & cluster are needed, for intervals
+    self.lastSilence = Silence.span(lastEnd, lastEnd, 0) if silences else None
+    self.lastCluster = Cluster(Silence.span(clusterEnd, clusterEnd, 0), self.params) if completed else None
+    self.currentSilence = Silence.span(start, end, power) if silenceOpen else None
+    self.currentCluster = None
+    if clusterOpen:
+      self.currentCluster = Cluster(Silence.span(firstStart, firstEnd, 0), self.params)
+      self.currentCluster.resume(Silence.span(lastStart, lastStop, 0), count)
+
+  def report(self, prefix, type, msg, start, end, interval, power):
+    "Logs silences/clusters/cuts in the standard format"
+    p = self.params
+    if not p.logging(prefix):
+      return
+    rate = p.videoRate
+    start &= kFrame_Mask
+    end &= kFrame_Mask
+    interval &= kFrame_Mask
+    duration = (end - start + 1) & kFrame_Mask
+    self.output('%s%c %7s %6d-%6d (%3d:%02d-%3d:%02d), %4d (%2d:%04.1f), %5d (%3d:%02d), [%7d]' % (
+      prefix, type, msg, signed64(start), signed64(end),
+      signed64(((start + p.rateRound) & kFrame_Mask) // p.rateInMins), round(float(f32(start) / rate)) % 60,
+      signed64(((end + p.rateRound) & kFrame_Mask) // p.rateInMins), round(float(f32(end) / rate)) % 60,
+      signed64(duration), signed64(((duration + 1) & kFrame_Mask) // p.rateInMins),
+      math.fmod(float(f32(duration) / rate), 60),
+      signed64(interval), signed64(((interval + p.rateRound) & kFrame_Mask) // p.rateInMins),
+      round(float(f32(interval) / rate)) % 60, int(power)))
+
+  def processSilence(self):
+    "Process a silence detection"
+    silence = self.currentSilence
+    self.currentSilence = None
+    # ignore detections that are too short
+    if silence.state == Silence.detection and silence.length < self.params.useMinQuiet:
+      return
+    # record new silence
+    silence.interval = silence.start - (1 if self.lastSilence is None else self.lastSilence.end - 1)
+    self.lastSilence = silence
+
+    # assign it to a cluster
+    if self.currentCluster:
+      # add to existing cluster
+      self.currentCluster.extend(silence)
+    elif silence.interval <= self.params.useMaxSep:  # only possible for very first silence
+      # First silence is close to prog start so extend cluster to the start
+      # by inserting a fake silence at prog start and starting the cluster there
+      self.currentCluster = Cluster(Silence(1, 0, Silence.progStart), self.params)
+      self.currentCluster.extend(silence)
+    else:
+      # this silence is the start of a new cluster
+      self.currentCluster = Cluster(silence, self.params)
+    self.report(prefixdebug, Silence.state_log[silence.state], 'Silence',
+                silence.start, silence.end, silence.interval, silence.power)
+
+  def processCluster(self):
+    "Process a completed cluster"
+    cluster = self.currentCluster
+    self.currentCluster = None
+    # record new cluster
+    cluster.interval = cluster.start.start - (1 if self.lastCluster is None else self.lastCluster.end.end - 1)
+    self.lastCluster = cluster
+
+    self.report(prefixinfo, Cluster.state_log[cluster.state], 'Cluster',
+                cluster.start.start, cluster.end.end, cluster.interval, cluster.silenceCount)
+
+    # only flag clusters at final state
+    if cluster.state > Cluster.unset:
+      if not self.params.onlyCutPreroll or cluster.state == Cluster.preroll:
+        self.report(prefixcut, '=', 'Cut', cluster.padStart, cluster.padEnd, 0, 0)
+
+  def feed(self, levels):
+    "Process the average audio levels of the next frames, reporting progress in a stream"
+    every = self.params.streamFrames
+    if not every:
+      self._feed(levels)
+      return
+    # silence reports progress after the frames that are multiples of the interval
+    while len(levels):
+      take = every - self.frames % every
+      self._feed(levels[:take])
+      levels = levels[take:]
+      if self.frames % every == 0:
+        self.output(prefixprogress + self.state())
+
+  def _feed(self, levels):
+    if self.adaptive is None:
+      self._run(levels)
+      return
+    # silence adapts the threshold after the frames that complete an update
+    while len(levels):
+      take = self.adaptive.kUpdate - self.adaptive.seen % self.adaptive.kUpdate
+      self._run(levels[:take])
+      threshold = self.adaptive.add(levels[:take])
+      if threshold is not None:
+        self.threshold = threshold
+      levels = levels[take:]
+
+  def _run(self, levels):
+    count = len(levels)
+    if not count:
+      return
+    base = self.frames
+    silent = levels < self.threshold
+    # split frames into runs of silence/noise
+    edges = numpy.flatnonzero(silent[1:] != silent[:-1]) + 1
+    starts = [0] + edges.tolist()
+    ends = edges.tolist() + [count]
+    values = levels.tolist()
+    for i, j in zip(starts, ends):
+      if silent[i]:
+        if self.currentSilence is None:
+          # transition to silence
+          self.currentSilence = Silence(base + i + 1, values[i])
+          i += 1
+        for k in range(i, j):
+          self.currentSilence.extend(base + k + 1, values[k])
+      else:
+        frame = base + i + 1  # first noise frame
+        if self.currentSilence:
+          # transition out of silence uses up this frame
+          self.processSilence()
+          frame += 1
+        # in noise: cluster completes at the first frame beyond its completion point
+        if self.currentCluster and max(frame, self.currentCluster.completesAt + 1) <= base + j:
+          self.processCluster()
+    self.frames += count
+
+  def end(self):
+    "Complete detection at the end of the input"
+    # Complete any current silence (prog may have finished in silence)
+    if self.currentSilence:
+      self.processSilence()
+    # extend any cluster close to prog end
+    if self.currentCluster and self.frames <= self.currentCluster.completesAt:
+      # generate a silence at prog end and extend cluster to it
+      self.currentSilence = Silence(self.frames, 0, Silence.progEnd)
+      self.processSilence()
+    # Complete any final cluster
+    if self.currentCluster:
+      self.processCluster()
+
+
+class AudioReader:
+  "Reads AU audio from a stream as 32-bit scaled samples, as libsndfile does"
+
+  kEncodings = {3: '>i2', 5: '>i4', 6: '>f4'}  # 16/32-bit PCM & float
+
+  def __init__(self, stream):
+    "Parses the AU header"
+    self.stream = stream
+    header = self._read(24)
+    if len(header) < 24 or header[:4] != b'.snd':
+      raise DetectError('Input is not AU audio')
+    offset, size, encoding, self.rate, self.channels = numpy.frombuffer(header, '>u4', 5, 4).tolist()
+    if encoding not in self.kEncodings:
+      raise DetectError('Unsupported AU encoding %d' % encoding)
+    self.dtype = numpy.dtype(self.kEncodings[encoding])
+    self._read(offset - 24)
+
+  def _read(self, count):
+    "Reads count bytes, fewer only at end of input"
+    data = bytearray(count)
+    view = memoryview(data)
+    got = 0
+    while got < count:
+      n = self.stream.readinto(view[got:])
+      if not n:
+        break
+      got += n
+    return data[:got]
+
+  def read(self, frames):
+    "Returns the next <frames> samples per channel (fewer at end of input) as int64"
+    data = self._read(frames * self.channels * self.dtype.itemsize)
+    data = data[:len(data) - len(data) % (self.channels * self.dtype.itemsize)]
+    samples = numpy.frombuffer(data, self.dtype)
+    if self.dtype.kind == 'f':
+      return numpy.clip(numpy.rint(samples * float(kInt_Max)), -kInt_Max - 1, kInt_Max).astype(numpy.int64)
+    samples = samples.astype(numpy.int64)
+    if self.dtype.itemsize == 2:
+      samples <<= 16
+    return samples
+
+
+def frameLevels(reader, params, blockFrames = kBlock_Frames, frame = 0, sample = 0, endFrame = None):
+  "Generates arrays of per-frame levels from <frame> up to <endFrame> or end of input, for input starting at <sample>"
+  channels = reader.channels
+  levelChannels = params.refChannels or channels
+  rate = reader.rate
+  # discard input before the first frame
+  skip = params.frameStart(rate, frame) - sample
+  if skip < 0:
+    raise DetectError('Input starts after frame %d' % frame)
+  while skip > 0:
+    got = len(reader.read(min(skip, rate))) // channels
+    if not got:
+      return
+    skip -= got
+  pending = numpy.zeros(0, numpy.int64)  # samples of an incomplete frame
+  while True:
+    count = blockFrames if endFrame is None else min(blockFrames, endFrame - frame)
+    if count <= 0:
+      break
+    # sample boundaries of the next block of frames
+    bounds = numpy.array([params.frameStart(rate, f) for f in range(frame, frame + count + 1)],
+                         numpy.int64)
+    need = int(bounds[-1] - bounds[0]) - len(pending) // channels
+    samples = reader.read(need)
+    if len(pending):
+      samples = numpy.concatenate((pending, samples))
+    have = len(samples) // channels
+    # only complete frames are measured, like silence.cpp
+    complete = int(numpy.searchsorted(bounds - bounds[0], have, 'right')) - 1
+    if complete > 0:
+      offsets = (bounds[:complete + 1] - bounds[0]) * channels
+      window = numpy.diff(bounds[:complete + 1]) * levelChannels
+      used = samples[:offsets[-1]]
+      if params.useRms:
+        sums = numpy.add.reduceat(numpy.square(used.astype(numpy.float64)), offsets[:-1])
+        yield numpy.sqrt(sums / window)
+      else:
+        sums = numpy.add.reduceat(numpy.abs(used), offsets[:-1])
+        yield sums // window
+      frame += complete
+      pending = samples[offsets[-1]:]
+    if have < int(bounds[-1] - bounds[0]):
+      break  # end of input
+
+
+def quantise(levels):
+  "Profile values of levels: hundredths of a dB below full scale, as silence.cpp stores them"
+  with numpy.errstate(divide='ignore'):
+    values = numpy.clip(numpy.rint(-2000 * numpy.log10(levels / float(kInt_Max))), 0, kProfile_None - 1)
+  return numpy.where(levels > 0, values, kProfile_None).astype('<u2')
+
+def dequantise(values):
+  "Levels of profile values"
+  levels = kInt_Max * numpy.power(10.0, values / -2000.0)
+  levels[values == kProfile_None] = 0
+  return levels
+
+class ProfileWriter:
+  "Writes frame levels to a gzipped profile, as silence -p does"
+
+  def __init__(self, path, params, channels, source = (0, 0)):
+    "channels are those the levels are averaged over, source is the (size, mtime) of the recording if known"
+    self.file = gzip.open(path, 'wb')
+    self.file.write(kProfile_Header.pack(kProfile_Magic, 2, params.rateNum, params.rateDen,
+                                         1 if params.useRms else 0, channels, *source))
+
+  def write(self, levels):
+    self.file.write(quantise(levels).tobytes())
+
+  def close(self):
+    self.file.close()
+
+def readProfile(path):
+  "Returns (rate, rms, levels) of a profile, where rate is a fraction string for Params"
+  with gzip.open(path, 'rb') as profile:
+    data = profile.read()
+  if len(data) < kProfile_Header_V1.size:
+    raise DetectError('Profile is truncated')
+  magic, version, num, den, flags = kProfile_Header_V1.unpack_from(data)
+  header = {1: kProfile_Header_V1, 2: kProfile_Header}.get(version)
+  if magic != kProfile_Magic or header is None:
+    raise DetectError('Not a level profile')
+  if len(data) < header.size:
+    raise DetectError('Profile is truncated')
+  values = numpy.frombuffer(data, '<u2', (len(data) - header.size) // 2, header.size)
+  return '%d/%d' % (num, den), bool(flags & 1), dequantise(values)
+
+def detectLevels(blocks, params, state = None):
+  "Runs detection over arrays of consecutive frame levels, generating silence's log lines"
+  lines = []
+  detector = Detector(params, lines.append)
+  if state:
+    detector.restore(state)
+  for levels in blocks:
+    detector.feed(levels)
+    for line in lines:
+      yield line
+    del lines[:]
+  detector.end()
+  for line in lines:
+    yield line
+
+def saved(blocks, writer):
+  "Passes on arrays of levels, saving them to a profile"
+  try:
+    for levels in blocks:
+      writer.write(levels)
+      yield levels
+  finally:
+    writer.close()
+
+def detect(stream, params, blockFrames = kBlock_Frames, profile = None, state = None, sample = 0):
+  "Runs detection over AU audio from a binary stream, generating silence's log lines. Resumed audio starts at <sample>"
+  for line in params.header():
+    yield line
+  if params.logging(prefixdebug):
+    yield '%sUsing NumPy energy kernels' % prefixdebug
+  try:
+    reader = AudioReader(stream)
+  except DetectError as e:
+    yield prefixerr + str(e)
+    return
+  frame = int(state.split()[0]) if state else 0
+  blocks = frameLevels(reader, params, blockFrames, frame, sample)
+  if profile:
+    blocks = saved(blocks, ProfileWriter(profile, params, params.refChannels or reader.channels))
+  try:
+    for line in detectLevels(blocks, params, state):
+      yield line
+  except DetectError as e:
+    yield prefixerr + str(e)
+
+
+def usage():
+  "Prints usage and exits"
+  for line in ['Usage: silencedetect.py [-f <fps>] [-c <channels>] [-r] [-p <file>] [-i <file>] [-s <frames>] [-R <state> [-a <sample>]] [-A <margin>] [-v <level>] <tail_pid> <threshold> <minquiet> '
+               '<mindetect> <minlength> <maxsep> <pad> <preroll>',
+               'Arguments are the same as silence. <tail_pid> is ignored.',
+               '-i <file> detects from the levels in a profile saved by -p, its frame rate overrides -f.',
+               '-R <state> resumes from a progress line, with AU audio starting at sample -a of the recording.',
+               'Otherwise AU format audio is expected on stdin.']:
+    print(prefixerr + line)
+  sys.exit(1)
+
+def main():
+  "Command line equivalent of silence"
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], 't:nc:rf:b:p:i:s:R:a:A:v:')
+  except getopt.GetoptError:
+    usage()
+  if len(args) != 8:
+    usage()
+  opts = dict(opts)
+  if '-n' in opts or '-b' in opts:
+    print(prefixerr + 'Native decoding and binary records are only available in silence')
+    sys.exit(1)
+  try:
+    rate, rms = opts.get('-f', '25/1'), '-r' in opts
+    if '-i' in opts:
+      rate, rms, levels = readProfile(opts['-i'])
+    params = Params(args[1:], rate, opts.get('-c', 0), rms, opts.get('-v', 2), opts.get('-s', 0),
+                    opts.get('-A', 0))
+    state = opts.get('-R')
+    try:
+      frame, sample = int(state.split()[0]) if state else 0, int(opts.get('-a', 0))
+    except (ValueError, IndexError):
+      raise DetectError('Could not parse resume options')
+  except (DetectError, IOError, OSError) as e:
+    print(prefixerr + str(e))
+    sys.exit(1)
+  if '-i' in opts:
+    lines = params.header() + list(detectLevels([levels[frame:]], params, state))
+  else:
+    lines = detect(sys.stdin.buffer, params, profile=opts.get('-p'), state=state, sample=sample)
+  strip = sys.stdout.isatty()  # remove logging prefixes if writing to terminal
+  for line in lines:
+    print(line.split(kDelimiter, 1)[1] if strip else line,
+          flush=line.startswith(prefixcut) or line.startswith(prefixprogress))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Hands a commflag job to a running "silence.py --daemon", which keeps its database &
+# backend connections between jobs. Runs silence.py itself when no daemon is listening.
+# Takes the same arguments as silence.py & exits with the job's status.
+# v1.0 Initial version
+# v1.1 Socket in our own directory, only used if our user owns it
+
+import os
+import socket
+import sys
+import json
+
+kExe_Silence_Py = '/usr/local/bin/silence.py'
+kSocket_Path = '~/.mythtv/silence.sock'  # in our own directory, must correlate with silence.py
+
+def socketPath(argv):
+  "Returns the socket given by --socket or the default"
+  for i, arg in enumerate(argv):
+    if arg == '--socket' and i + 1 < len(argv):
+      return os.path.expanduser(argv[i + 1])
+    if arg.startswith('--socket='):
+      return os.path.expanduser(arg.split('=', 1)[1])
+  return os.path.expanduser(kSocket_Path)
+
+def main():
+  "Run a job in the daemon or fall back to silence.py"
+  argv = sys.argv[1:]
+  path = socketPath(argv)
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    # a socket made by another user could be impersonating the daemon
+    if os.stat(path).st_uid != os.getuid():
+      raise OSError('%s is not owned by us' % path)
+    client.connect(path)
+  except (IOError, OSError):
+    # no daemon: do the job ourselves
+    client.close()
+    os.execv(kExe_Silence_Py, [kExe_Silence_Py] + argv)
+  with client:
+    client.sendall((json.dumps({'argv': argv}) + '\n').encode('utf-8'))
+    reply = client.makefile('rb').readline()
+  if not reply:
+    print('silence.py daemon exited before the job finished', file=sys.stderr)
+    sys.exit(1)
+  sys.exit(json.loads(reply.decode('utf-8'))['status'])
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# Tests of silence.py that don't need a MythTV backend, which is replaced by fakes.
+# v1.0 Initial version, following a recording whilst the backend fails
+# v1.1 Follow without inotify
+# v1.2 Decoders for segments come from the scheduler's pool
+# v1.3 Level profiles are only reused for the recording & measurement they were made with (needs NumPy)
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+try:
+  import MythTV
+except ImportError:
+  # the bindings are only used to talk to MythTV, which these tests replace
+  MythTV = types.ModuleType('MythTV')
+  class MythLog:
+    ERR, WARNING, INFO, DEBUG, COMMFLAG = 3, 4, 6, 7, 0
+    def __init__(self, *args):
+      pass
+  class MythError(Exception):
+    pass
+  MythTV.MythLog = MythLog
+  MythTV.MythError = MythError
+  sys.modules['MythTV'] = MythTV
+
+import silence
+
+class LOGGER:
+  "Collects log messages"
+
+  def __init__(self):
+    self.messages = []
+
+  def log(self, msg, level = None):
+    self.messages.append((level, msg))
+
+class BACKEND:
+  "Answers recorder queries, raising MythError once failing is set"
+
+  def __init__(self):
+    self.failing = False
+
+  def getRecording(self, chanid, starttime):
+    if self.failing:
+      raise MythTV.MythError('Backend connection lost')
+    return types.SimpleNamespace(recstatus=-2)  # rsRecording
+
+class FollowTest(unittest.TestCase):
+  "A followed recording must keep going whilst the backend can't say whether it has finished"
+
+  def setUp(self):
+    self.interval = silence.kPoll_Interval
+    silence.kPoll_Interval = 0.05
+    fd, self.path = tempfile.mkstemp(suffix='.ts')
+    os.close(fd)
+    self.backend = BACKEND()
+    self.logger = LOGGER()
+
+  def tearDown(self):
+    silence.kPoll_Interval = self.interval
+    os.unlink(self.path)
+
+  def append(self, data):
+    "The recorder writes some more"
+    with open(self.path, 'ab') as f:
+      f.write(data)
+
+  def follow(self, timeout):
+    "Starts following the file, returning the follower & a function that returns what it sent"
+    readFd, writeFd = os.pipe()
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(iter(lambda: os.read(readFd, 65536), b'')))
+    reader.daemon = True  # a follower that never ends mustn't hang the tests
+    reader.start()
+    follower = silence.FOLLOWER(self.path, os.fdopen(writeFd, 'wb'),
+                                lambda: silence.recordingInProgress(self.backend, 1, None),
+                                self.logger, timeout)
+    follower.start()
+    def sent():
+      reader.join(5)
+      os.close(readFd)
+      return b''.join(received)
+    return follower, sent
+
+  def test_backend_fails_part_way(self):
+    self.append(b'a' * 1000)
+    follower, sent = self.follow(timeout=0.5)
+    time.sleep(0.3)
+    self.backend.failing = True
+    # the recording carries on for longer than the timeout, without the backend
+    for i in range(10):
+      self.append(b'b' * 1000)
+      time.sleep(0.1)
+      self.assertTrue(follower.is_alive())
+    # then the file goes quiet, which is all the follower can go on
+    follower.join(5)
+    self.assertFalse(follower.is_alive())
+    self.assertEqual(sent(), b'a' * 1000 + b'b' * 10000)
+    self.assertTrue(any('Backend connection lost' in msg for level, msg in self.logger.messages))
+
+  def test_backend_fails_without_inotify(self):
+    def unavailable(filename):
+      raise OSError('inotify unavailable')
+    inotify = silence.INOTIFY
+    silence.INOTIFY = unavailable
+    try:
+      self.append(b'a' * 1000)
+      self.backend.failing = True
+      follower, sent = self.follow(timeout=0.5)
+      follower.join(5)
+      self.assertFalse(follower.is_alive())
+      self.assertEqual(sent(), b'a' * 1000)
+    finally:
+      silence.INOTIFY = inotify
+    failures = [msg for level, msg in self.logger.messages if 'Backend connection lost' in msg]
+    self.assertEqual(len(failures), 1)
+
+class FinishedTest(unittest.TestCase):
+  "Whether a recording is flagged as finished (batch) or followed"
+
+  def test_backend_error_follows(self):
+    backend = BACKEND()
+    backend.failing = True
+    rec = types.SimpleNamespace(chanid=1, starttime=None, endtime=None)
+    self.assertFalse(silence.recordingFinished(backend, rec))
+
+  def test_no_recorder_is_finished(self):
+    backend = types.SimpleNamespace(getRecording=lambda chanid, starttime: None)
+    rec = types.SimpleNamespace(chanid=1, starttime=None, endtime=None)
+    self.assertTrue(silence.recordingFinished(backend, rec))
+
+  def test_backend_error_is_still_recording(self):
+    backend = BACKEND()
+    backend.failing = True
+    scheduler = silence.SCHEDULER(None, backend, LOGGER())
+    rec = types.SimpleNamespace(chanid=1, starttime=None)
+    self.assertEqual(scheduler._priority(rec), 1)
+
+class SchedulerTest(unittest.TestCase):
+  "Segments of a job share the decoder pool with other jobs"
+
+  def setUp(self):
+    self.loadavg = os.getloadavg
+    os.getloadavg = lambda: (0.0, 0.0, 0.0)
+    self.scheduler = silence.SCHEDULER(None, BACKEND(), LOGGER(), workers=4)
+    self.scheduler.acquire(types.SimpleNamespace(chanid=1, starttime=None))
+
+  def tearDown(self):
+    os.getloadavg = self.loadavg
+
+  def test_segments_limited_by_workers(self):
+    self.assertEqual(self.scheduler.acquireMore(7), 3)
+    self.assertEqual(self.scheduler.acquireMore(1), 0)
+    self.scheduler.release(3)
+    self.assertEqual(self.scheduler.running, 1)
+
+  def test_no_segments_whilst_jobs_wait(self):
+    self.scheduler.waiting.append([1, 0, None])
+    self.assertEqual(self.scheduler.acquireMore(3), 0)
+
+class ProfileTest(unittest.TestCase):
+  "--cached only detects from a profile measured from the same recording, as the job would measure it"
+
+  def setUp(self):
+    import numpy
+    import silencedetect
+    self.silencedetect = silencedetect
+    self.numpy = numpy
+    self.dir = tempfile.mkdtemp()
+    self.recording = os.path.join(self.dir, 'recording.ts')
+    with open(self.recording, 'wb') as f:
+      f.write(b'x' * 1000)
+    self.profile = self.recording + silence.kProfile_Suffix
+
+  def tearDown(self):
+    for name in os.listdir(self.dir):
+      os.unlink(os.path.join(self.dir, name))
+    os.rmdir(self.dir)
+
+  def save(self, rate = '25', rms = False, channels = 6):
+    "Saves a profile as a job would, stamped with the recording"
+    params = self.silencedetect.Params(['-75', '0.16', '6', '120', '120', '0.48', '0'], rate, rms=rms)
+    writer = self.silencedetect.ProfileWriter(self.profile, params, channels)
+    writer.write(self.numpy.full(100, 1000.0))
+    writer.close()
+    silence.stampProfile(self.profile, silence.profileSource(self.recording))
+
+  def mismatch(self, fps = '25'):
+    return silence.profileMismatch(self.profile, silence.profileSource(self.recording), fps)
+
+  def test_matching(self):
+    self.save('30000/1001')
+    self.assertIsNone(self.mismatch('29.97'))
+    rate, rms, levels = self.silencedetect.readProfile(self.profile)
+    self.assertEqual((rate, rms, len(levels)), ('30000/1001', False, 100))
+
+  def test_measurement(self):
+    self.save(rms=True)
+    self.assertIn('RMS', self.mismatch())
+    self.save(channels=2)
+    self.assertIn('channels', self.mismatch())
+    self.save()
+    self.assertIn('fps', self.mismatch('50'))
+
+  def test_replaced_recording(self):
+    self.save()
+    with open(self.recording, 'ab') as f:
+      f.write(b'y')
+    self.assertIn('another version', self.mismatch())
+
+  def test_old_format(self):
+    import gzip
+    with gzip.open(self.profile, 'wb') as f:
+      f.write(self.silencedetect.kProfile_Header_V1.pack(b'SLNC', 1, 25, 1, 0) + bytes(200))
+    self.assertIn('format', self.mismatch())
+    self.assertEqual(len(self.silencedetect.readProfile(self.profile)[2]), 100)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# Finds presets for silence.py by scoring a grid of values against a hand-made cut list.
+# Levels come from a profile saved by silence.py --profile, or are decoded once, then
+# detection (silencedetect.py) is run for every combination of values in parallel.
+# Prints the best combinations as lines for a preset file.
+# v1.0 Initial version
+# v1.1 Decode a recording at its own frame rate, as silence.py does
+# v1.2 Saved profiles identify the recording, so silence.py --cached can use them
+# Requires numpy
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+
+import numpy
+
+import silencedetect
+
+kProfile_Suffix = '.silence.gz'  # must correlate with silence.py
+kUpmix_Channels = '6'            # must correlate with silence.py
+kMark_Cut_End = 0                # recordedmarkup types of a cut list
+kMark_Cut_Start = 1
+
+# values tried by default, in preset order
+kGrid = [
+  ('thresh',    '-85,-80,-75,-70'),
+  ('minquiet',  '0.08,0.16,0.32'),
+  ('mindetect', '2,3,4,6'),
+  ('minbreak',  '60,90,120'),
+  ('maxsep',    '60,90,120'),
+  ('pad',       '0,0.48,1')]
+
+levels = None     # frame levels shared with the workers
+reference = None  # frames inside the reference cuts
+rate = None       # frame rate of the levels
+
+def parseCuts(text):
+  "Parses cuts given as 'start-end,start-end...' frames"
+  cuts = []
+  for cut in text.split(','):
+    start, end = cut.split('-')
+    cuts.append((int(start), int(end)))
+  return cuts
+
+def markupCuts(db, rec):
+  "Returns the cut list of a recording from recordedmarkup"
+  with db as cursor:
+    cursor.execute('SELECT mark, type FROM recordedmarkup WHERE chanid=%s AND starttime=%s '
+                   'AND type IN (%s, %s) ORDER BY mark', (rec.chanid, rec.starttime, kMark_Cut_Start, kMark_Cut_End))
+    marks = cursor.fetchall()
+  cuts = []
+  start = None
+  for mark, type in marks:
+    if type == kMark_Cut_Start:
+      start = mark
+    elif start is not None:
+      cuts.append((start, mark))
+      start = None
+  if start is not None:
+    cuts.append((start, None))  # cut to the end
+  return cuts
+
+def mask(cuts, frames):
+  "Returns a boolean array of the frames (counting from 1, as cuts do) inside cuts"
+  inside = numpy.zeros(frames + 1, bool)
+  for start, end in cuts:
+    inside[max(start, 0):frames + 1 if end is None else end + 1] = True
+  return inside[1:]
+
+def decodeLevels(filename, fps, profile):
+  "Decodes a recording as silence.py does, returning its levels and optionally saving them"
+  params = silencedetect.Params(['0'] * 7, fps)
+  info = os.stat(filename)  # before decoding, so a recording that is still growing won't match later
+  p = subprocess.Popen(["mythffmpeg", "-loglevel", "quiet", "-i", filename, "-f", "au",
+                        "-ac", kUpmix_Channels, "-"], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+  blocks = list(silencedetect.frameLevels(silencedetect.AudioReader(p.stdout), params))
+  p.stdout.close()
+  p.wait()
+  decoded = numpy.concatenate(blocks) if blocks else numpy.zeros(0)
+  if profile:
+    writer = silencedetect.ProfileWriter(profile, params, int(kUpmix_Channels), (info.st_size, int(info.st_mtime)))
+    writer.write(decoded)
+    writer.close()
+  return decoded
+
+def share(_levels, _reference, _rate):
+  "Sets the data used by score() in a worker"
+  global levels, reference, rate
+  levels, reference, rate = _levels, _reference, _rate
+
+def score(values):
+  "Returns (error seconds, missed seconds, extra seconds, values) of detection with a set of values"
+  params = silencedetect.Params([str(v) for v in values] + ['0'], rate, logLevel=0)
+  lines = []
+  for line in silencedetect.detectLevels([levels], params):
+    if line.startswith(silencedetect.prefixcut):
+      numbers = re.findall(r'\d+', line.split(silencedetect.kDelimiter, 1)[1])
+      lines.append((int(numbers[0]), int(numbers[1])))
+  detected = mask(lines, len(levels))
+  fps = params.rateNum / params.rateDen
+  missed = numpy.count_nonzero(reference & ~detected) / fps
+  extra = numpy.count_nonzero(detected & ~reference) / fps
+  return missed + extra, missed, extra, values
+
+def main():
+  "Rank presets for a recording"
+  parser = argparse.ArgumentParser(description='Finds silence.py presets that best match a cut list')
+  parser.add_argument('--chanid', type=int, help='Recording chanid, with --starttime')
+  parser.add_argument('--starttime', help='Recording starttime, with --chanid')
+  parser.add_argument('--profile', help='Level profile (default: the one saved next to the recording)')
+  parser.add_argument('--file', help='Recording to decode if there is no profile')
+  parser.add_argument('--save', action="store_true", help='Save the decoded levels as the profile')
+  parser.add_argument('--fps', help='Frame rate of a decoded recording (default: the recording\'s, or 25 for a file)')
+  parser.add_argument('--reference', help='Cuts as "start-end,..." frames (default: the cut list of the recording)')
+  parser.add_argument('--name', help='Preset name to print (default: the recording title)')
+  for arg, default in kGrid:
+    parser.add_argument('--' + arg, default=default, help='Values to try (default: %s)' % default)
+  parser.add_argument('--top', type=int, default=10, help='Number of presets to print')
+  parser.add_argument('--jobs', type=int, default=0, help='Worker processes (default: number of cores)')
+  args = parser.parse_args()
+
+  # find the recording & its cut list
+  name = args.name
+  cuts = parseCuts(args.reference) if args.reference else None
+  filename = args.file
+  fps = args.fps
+  if args.chanid and args.starttime:
+    import MythTV
+    db = MythTV.MythDB()
+    try:
+      starttime = MythTV.datetime.duck(args.starttime)
+    except AttributeError:
+      starttime = args.starttime
+    rec = MythTV.Recorded((args.chanid, starttime), db)
+    if name is None:
+      name = re.escape(rec.title.lower())
+    if cuts is None:
+      cuts = markupCuts(db, rec)
+    if filename is None:
+      sg = MythTV.findfile(rec.basename, rec.storagegroup, db)
+      if sg:
+        filename = os.path.join(sg.dirname, rec.basename)
+    if fps is None and filename:
+      # the cut list is numbered at the recording's rate, so the levels must be too
+      import silence
+      fps = silence.frameRate(filename, db, rec, silence.MYLOG(db))
+  if not cuts:
+    print('No reference cuts: make a cut list for the recording or use --reference', file=sys.stderr)
+    sys.exit(1)
+
+  # get the levels, decoding only if there is no profile
+  profile = args.profile or (filename + kProfile_Suffix if filename else None)
+  try:
+    if profile and os.path.exists(profile):
+      fps, rms, measured = silencedetect.readProfile(profile)
+    elif filename:
+      fps = fps or '25'
+      measured = decodeLevels(filename, fps, profile if args.save else None)
+    else:
+      print('Give a recording or a profile', file=sys.stderr)
+      sys.exit(1)
+  except (silencedetect.DetectError, IOError, OSError) as e:
+    print('Could not read levels: %s' % e, file=sys.stderr)
+    sys.exit(1)
+
+  # score every combination
+  grid = [[float(v) for v in getattr(args, arg).split(',')] for arg, default in kGrid]
+  combos = list(itertools.product(*grid))
+  shared = (measured, mask(cuts, len(measured)), fps)
+  with multiprocessing.Pool(args.jobs or None, share, shared) as pool:
+    results = sorted(pool.imap_unordered(score, combos, 16), key=lambda r: r[:3])
+
+  print('# %d combinations scored against %d cuts, best first' % (len(combos), len(cuts)))
+  print('# title/callsign, threshold, minquiet, mindetect, minbreak, maxsep, padding, preroll')
+  for error, missed, extra, values in results[:args.top]:
+    print('%s, %s, 0, missed %.1fs extra %.1fs' % (name or 'name', ', '.join('%g' % v for v in values),
+                                                    missed, extra))
+
+if __name__ == '__main__':
+  main()